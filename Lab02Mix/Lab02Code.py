@@ -18,19 +18,22 @@
 
 from collections import namedtuple
 from hashlib import sha512
-from struct import pack, unpack
+from struct import pack, unpack, pack_into, unpack_from
 from binascii import hexlify
 from os import urandom
 
-def aes_ctr_enc_dec(key, iv, input):
+def aes_ctr_enc_dec(key, iv, input, aes=None):
     """ A helper function that implements AES Counter (CTR) Mode encryption and decryption. 
     Expects a key (16 byte), and IV (16 bytes) and an input plaintext / ciphertext.
+    An existing Cipher("AES-128-CTR") object may be passed as aes to avoid building 
+    a new one for every call.
 
     If it is not obvious convince yourself that CTR encryption and decryption are in 
     fact the same operations.
     """
     
-    aes = Cipher("AES-128-CTR") 
+    if aes is None:
+        aes = Cipher("AES-128-CTR") 
 
     enc = aes.enc(key, iv)
     output = enc.update(input)
@@ -63,52 +66,7 @@ def mix_server_one_hop(private_key, message_list):
         - the address and message are decrypted, decoded and returned
 
     """
-    G = EcGroup()
-
-    out_queue = []
-
-    # Process all messages
-    for msg in message_list:
-
-        ## Check elements and lengths
-        if not G.check_point(msg.ec_public_key) or \
-               not len(msg.hmac) == 20 or \
-               not len(msg.address) == 258 or \
-               not len(msg.message) == 1002:
-           raise Exception("Malformed input message")
-
-        ## First get a shared key
-        shared_element = private_key * msg.ec_public_key
-        key_material = sha512(shared_element.export()).digest()
-
-        # Use different parts of the shared key for different operations
-        hmac_key = key_material[:16]
-        address_key = key_material[16:32]
-        message_key = key_material[32:48]
-
-        ## Check the HMAC
-        h = Hmac(b"sha512", hmac_key)        
-        h.update(msg.address)
-        h.update(msg.message)
-        expected_mac = h.digest()
-
-        if not secure_compare(msg.hmac, expected_mac[:20]):
-            raise Exception("HMAC check failure")
-
-        ## Decrypt the address and the message
-        iv = b"\x00"*16
-
-        address_plaintext = aes_ctr_enc_dec(address_key, iv, msg.address)
-        message_plaintext = aes_ctr_enc_dec(message_key, iv, msg.message)
-
-        # Decode the address and message
-        address_len, address_full = unpack("!H256s", address_plaintext)
-        message_len, message_full = unpack("!H1000s", message_plaintext)
-
-        output = (address_full[:address_len], message_full[:message_len])
-        out_queue += [output]
-
-    return sorted(out_queue)
+    return sorted(_decode_one_hop_stream(private_key, message_list))
         
         
         
@@ -164,12 +122,78 @@ def mix_client_one_hop(public_key, address, message):
 
     
 
+#####################################################
+# EXTENSION -- The steps of decoding a 1-hop message.
+#
+# Decoding a round in separate passes (validate, derive
+# all keys, then decrypt) is no faster than decoding the
+# messages in turn: each shared key is a multiplication
+# of a different point, so nothing is shared across the
+# round, and petlib offers no bulk variant of it.
+
+def _one_hop_is_malformed(G, msg):
+    """ Returns True if a OneHopMixMessage has an invalid point or bad lengths. """
+    return not G.check_point(msg.ec_public_key) or \
+           not len(msg.hmac) == 20 or \
+           not len(msg.address) == 258 or \
+           not len(msg.message) == 1002
+
+def _shared_key_material(private_key, ec_public_key):
+    """ Derives the 64 bytes of key material shared with the sender of a message. """
+    shared_element = private_key * ec_public_key
+    return sha512(shared_element.export()).digest()
+
+def _decode_one_hop(msg, key_material, aes):
+    """ Checks the hmac of a OneHopMixMessage and returns the decoded
+        (address, message) tuple, given the shared key material. """
+    hmac_key = key_material[:16]
+    address_key = key_material[16:32]
+    message_key = key_material[32:48]
+
+    h = Hmac(b"sha512", hmac_key)
+    h.update(msg.address)
+    h.update(msg.message)
+    expected_mac = h.digest()
+
+    if not secure_compare(msg.hmac, expected_mac[:20]):
+        raise Exception("HMAC check failure")
+
+    iv = b"\x00"*16
+    address_plaintext = aes_ctr_enc_dec(address_key, iv, msg.address, aes)
+    message_plaintext = aes_ctr_enc_dec(message_key, iv, msg.message, aes)
+
+    address_len, address_full = unpack("!H256s", address_plaintext)
+    message_len, message_full = unpack("!H1000s", message_plaintext)
+
+    return (address_full[:address_len], message_full[:message_len])
+
+def time_mix_server_one_hop(batch_sizes=(100, 1000, 10000, 100000)):
+    """ Prints the throughput, in messages per second, of mix_server_one_hop
+        for rounds of different sizes. """
+    import time
+
+    G = EcGroup()
+    private_key = G.order().random()
+    public_key = private_key * G.generator()
+
+    messages = []
+    for size in batch_sizes:
+        while len(messages) < size:
+            messages += [mix_client_one_hop(public_key, urandom(256), urandom(1000))]
+        batch = messages[:size]
+
+        t1 = time.time()
+        mix_server_one_hop(private_key, batch)
+        t2 = time.time()
+        print("%7d messages: %9.1f msg/s" % (size, size / (t2 - t1)))
+
+
 #####################################################
 # TASK 3 -- Build a n-hop mix client.
 #           Mixes are in a fixed cascade.
 #
 
-from petlib.ec import Bn
+from petlib.ec import Bn, EcPt, POINT_CONVERSION_UNCOMPRESSED
 
 # This is the type of messages destined for the n-hop mix
 NHopMixMessage = namedtuple('NHopMixMessage', ['ec_public_key', 
@@ -190,83 +214,79 @@ def mix_server_n_hop(private_key, message_list, final=False):
         - either forwards or decodes the message. 
     """
 
-    G = EcGroup()
+    return list(mix_server_n_hop_stream(private_key, message_list, final))
 
-    out_queue = []
+def _n_hop_is_malformed(G, msg):
+    """ Returns True if a NHopMixMessage has an invalid point or bad lengths. """
+    return not isinstance(msg.ec_public_key, EcPt) or \
+           not G.check_point(msg.ec_public_key) or \
+           not isinstance(msg.hmacs, list) or \
+           not 0 < len(msg.hmacs) < 256 or \
+           not all(len(mac) == 20 for mac in msg.hmacs) or \
+           not len(msg.address) == 258 or \
+           not len(msg.message) == 1002
 
-    # Process all messages
-    for msg in message_list:
+def _decode_n_hop(G, private_key, msg, final, aes):
+    """ Decodes a single NHopMixMessage, returning either the NHopMixMessage
+        for the next mix or the (address, message) tuple if final=True. """
 
-        ## Check elements and lengths
-        if not G.check_point(msg.ec_public_key) or \
-               not isinstance(msg.hmacs, list) or \
-               not len(msg.hmacs[0]) == 20 or \
-               not len(msg.address) == 258 or \
-               not len(msg.message) == 1002:
-           raise Exception("Malformed input message")
-
-        ## First get a shared key
-        shared_element = private_key * msg.ec_public_key
-       
-        key_material = sha512(shared_element.export()).digest()
-        
-        
-        # Use different parts of the shared key for different operations
-        hmac_key = key_material[:16]
-        address_key = key_material[16:32]
-        message_key = key_material[32:48]
-        
-        # Extract a blinding factor for the public_key
-        blinding_factor = Bn.from_binary(key_material[48:])
-        new_ec_public_key = blinding_factor * msg.ec_public_key
-        #### Key material changes every time...soo each successive
-        #### node has key*r... 
-        
-        ## Check the HMAC
-        h = Hmac(b"sha512", hmac_key)
-        for other_mac in msg.hmacs[1:]:
-            h.update(other_mac)
-            
+    ## Check elements and lengths
+    if _n_hop_is_malformed(G, msg):
+       raise Exception("Malformed input message")
 
-        h.update(msg.address)
-        h.update(msg.message)
+    # Parsed packets hold memoryview slices, petlib needs bytes
+    hmacs = [_as_bytes(mac) for mac in msg.hmacs]
+    address, message = _as_bytes(msg.address), _as_bytes(msg.message)
 
-        expected_mac = h.digest()
-                
-        if not secure_compare(msg.hmacs[0], expected_mac[:20]):
-            raise Exception("HMAC check failure")
+    ## First get a shared key
+    key_material = _shared_key_material(private_key, msg.ec_public_key)
 
-        ## Decrypt the hmacs, address and the message
-        aes = Cipher("AES-128-CTR") 
+    # Use different parts of the shared key for different operations
+    hmac_key = key_material[:16]
+    address_key = key_material[16:32]
+    message_key = key_material[32:48]
 
-        # Decrypt hmacs
-        new_hmacs = []
-        for i, other_mac in enumerate(msg.hmacs[1:]):
-            # Ensure the IV is different for each hmac
-            iv = pack("H14s", i, b"\x00"*14)
+    ## Check the HMAC
+    h = Hmac(b"sha512", hmac_key)
+    for other_mac in hmacs[1:]:
+        h.update(other_mac)
 
-            hmac_plaintext = aes_ctr_enc_dec(hmac_key, iv, other_mac)
-            new_hmacs += [hmac_plaintext]
+    h.update(address)
+    h.update(message)
 
-        # Decrypt address & message
-        iv = b"\x00"*16
-        
-        address_plaintext = aes_ctr_enc_dec(address_key, iv, msg.address)
-        message_plaintext = aes_ctr_enc_dec(message_key, iv, msg.message)
+    expected_mac = h.digest()
+
+    if not secure_compare(hmacs[0], expected_mac[:20]):
+        raise Exception("HMAC check failure")
+
+    ## Decrypt the hmacs, address and the message
+    new_hmacs = []
+    for i, other_mac in enumerate(hmacs[1:]):
+        # Ensure the IV is different for each hmac
+        iv = pack("H14s", i, b"\x00"*14)
+
+        hmac_plaintext = aes_ctr_enc_dec(hmac_key, iv, other_mac, aes)
+        new_hmacs += [hmac_plaintext]
+
+    # Decrypt address & message
+    iv = b"\x00"*16
+
+    address_plaintext = aes_ctr_enc_dec(address_key, iv, address, aes)
+    message_plaintext = aes_ctr_enc_dec(message_key, iv, message, aes)
+
+    if final:
+        # Decode the address and message
+        address_len, address_full = unpack("!H256s", address_plaintext)
+        message_len, message_full = unpack("!H1000s", message_plaintext)
 
-        if final:
-            # Decode the address and message
-            address_len, address_full = unpack("!H256s", address_plaintext)
-            message_len, message_full = unpack("!H1000s", message_plaintext)
+        return (address_full[:address_len], message_full[:message_len])
 
-            out_msg = (address_full[:address_len], message_full[:message_len])
-            out_queue += [out_msg]
-        else:
-            # Pass the new mix message to the next mix
-            out_msg = NHopMixMessage(new_ec_public_key, new_hmacs, address_plaintext, message_plaintext)
-            out_queue += [out_msg]
+    # Extract a blinding factor for the public_key, and pass 
+    # the new mix message to the next mix
+    blinding_factor = Bn.from_binary(key_material[48:])
+    new_ec_public_key = blinding_factor * msg.ec_public_key
 
-    return out_queue
+    return NHopMixMessage(new_ec_public_key, new_hmacs, address_plaintext, message_plaintext)
 
 
 def mix_client_n_hop(public_keys, address, message):
@@ -277,102 +297,436 @@ def mix_client_n_hop(public_keys, address, message):
     an address ciphertext (256 + 2 bytes) and a message ciphertext (1002 bytes). 
 
     """
+    return MixClient(public_keys).encode(address, message)
+
+class MixClient(object):
+    """ An n-hop mix client bound to a fixed cascade of mixes.
+
+        The group, the generator (with its precomputed multiples) and the 
+        AES context are set up once, so that many messages can be encoded
+        for the same sequence of mix public keys. The list of public keys
+        given is copied and never modified.
+    """
+
+    def __init__(self, public_keys):
+        self.G = EcGroup()
+        self.g = self.G.generator()
+        self.o = self.G.order()
+        self.aes = Cipher("AES-128-CTR")
+
+        assert all(self.G.check_point(pub) for pub in public_keys)
+        self.public_keys = list(public_keys)
+
+        # Ensure the IV is different for each hmac
+        self.hmac_ivs = [pack("H14s", i, b"\x00"*14) for i in range(len(public_keys))]
+
+    def encode(self, address, message):
+        """ Encodes a message and its final address into a NHopMixMessage. """
+        assert isinstance(address, bytes) and len(address) <= 256
+        assert isinstance(message, bytes) and len(message) <= 1000
+
+        # Encode the address and message
+        # use those encoded values as the payload you encrypt!
+        address_plaintext = pack("!H256s", len(address), address)
+        message_plaintext = pack("!H1000s", len(message), message)
+
+        ## Generate a fresh public key
+        private_key = self.o.random()
+        client_public_key  = private_key * self.g
+
+        # Each mix forwards the public key multiplied by its blinding factor,
+        # so the i-th mix sees our key blinded by all earlier factors. Track
+        # the blinded private key so each hop costs a single multiplication.
+        blinded_key = private_key
+        key_digests = []
+        for pub in self.public_keys:
+            key_digest = sha512(pub.pt_mul(blinded_key).export()).digest()
+            key_digests.append(key_digest)
+
+            # the blinding factor that this hop will use
+            blinding_factor = Bn.from_binary(key_digest[48:])
+            blinded_key = blinded_key.mod_mul(blinding_factor, self.o)
+
+        iv = b"\x00"*16
+        address_cipher = address_plaintext
+        message_cipher = message_plaintext
+        hmacs = []
+
+        ## The layer of the last mix is the innermost, so encrypt it first
+        for key_digest in reversed(key_digests):
+            hmac_key = key_digest[:16]
+            address_key = key_digest[16:32]
+            message_key = key_digest[32:48]
+
+            ## 1. Encrypt the address and the message
+            address_cipher = aes_ctr_enc_dec(address_key, iv, address_cipher, self.aes)
+            message_cipher = aes_ctr_enc_dec(message_key, iv, message_cipher, self.aes)
+
+            ## 2. Encrypt the hmacs of the following mixes
+            hmacs = [aes_ctr_enc_dec(hmac_key, self.hmac_ivs[i], mac, self.aes)
+                     for i, mac in enumerate(hmacs)]
+
+            ## 3. Compute the hmac of this mix
+            h = Hmac(b"sha512", hmac_key)
+            for mac in hmacs:
+                h.update(mac)
+            h.update(address_cipher)
+            h.update(message_cipher)
+
+            hmacs = [h.digest()[:20]] + hmacs
+
+        return NHopMixMessage(client_public_key, hmacs, address_cipher, message_cipher)
+
+    def encode_many(self, pairs):
+        """ Encodes a sequence of (address, message) pairs into a list of NHopMixMessages. """
+        return [self.encode(address, message) for address, message in pairs]
+
+def time_mix_client_n_hop(max_hops=20, number_of_messages=50):
+    """ Prints the cost of encoding a message with mix_client_n_hop 
+        for routes of 1 to max_hops hops. """
+    import time
+
     G = EcGroup()
-    # assert G.check_point(public_key)
-    assert isinstance(address, bytes) and len(address) <= 256
-    assert isinstance(message, bytes) and len(message) <= 1000
+    public_keys = [G.order().random() * G.generator() for _ in range(max_hops)]
 
-    # Encode the address and message
-    # use those encoded values as the payload you encrypt!
-    address_plaintext = pack("!H256s", len(address), address)
-    message_plaintext = pack("!H1000s", len(message), message)
+    for hops in range(1, max_hops + 1):
+        t1 = time.time()
+        for _ in range(number_of_messages):
+            mix_client_n_hop(public_keys[:hops], b"Alice", b"Dear Alice,\nHello!\nBob")
+        t2 = time.time()
+        print("%2d hops: %7.3f ms per message" % (hops, 1000 * (t2 - t1) / number_of_messages))
 
-    ## Generate a fresh public key
-    private_key = G.order().random()
-    client_public_key  = private_key * G.generator()
 
-    iv = b"\x00"*16
+def time_mix_client(number_of_messages=1000, hops=3):
+    """ Prints the throughput of mix_client_n_hop against MixClient.encode_many. """
+    import time
 
-    # caluculate the blinding factor of all the
-    # hops, can't be done during hmacs as it's in a different order.
-    # 
-    blind_factors = []
-    shared_keys = []
-    for i,k in enumerate(public_keys):
-        if i == 0:
-            blind_factors.append(1)
-        else:
-
-            pub_key = public_keys[i-1]
-
-            # The shared key that the hop will use to calculate the factor
-            shared_key = shared_keys[i-1]
-            key_digest = sha512(shared_key).digest()
-            # the blinding factor that they will use
-            blinding_factor = Bn.from_binary(key_digest[48:])
-            blind_factors.append(blinding_factor)
+    G = EcGroup()
+    public_keys = [G.order().random() * G.generator() for _ in range(hops)]
+    pairs = [(urandom(256), urandom(1000)) for _ in range(number_of_messages)]
 
-        shared_key = public_keys[i].pt_mul(private_key)
-        for j, fac in enumerate(blind_factors[0:i+1]):
-            shared_key = shared_key.pt_mul(blind_factors[j])
-        shared_key = shared_key.export()
-        shared_keys.append(shared_key)
+    t1 = time.time()
+    for address, message in pairs:
+        mix_client_n_hop(public_keys, address, message)
+    t2 = time.time()
+    print("mix_client_n_hop       : %9.1f msg/s" % (number_of_messages / (t2 - t1)))
 
-    ## Reverse the key lists, since we will compute hmacs in reverse order
-    shared_keys.reverse()
-    public_keys.reverse()
+    t1 = time.time()
+    MixClient(public_keys).encode_many(pairs)
+    t2 = time.time()
+    print("MixClient.encode_many  : %9.1f msg/s" % (number_of_messages / (t2 - t1)))
 
-    message_ciphers = []
-    address_ciphers = []
-    hmacs = []
-    
-    previous_hmac_key = None
-    for i, pub in enumerate(public_keys):
-        # Get shared key from precomputed list 
-        shared_key = shared_keys[i]
-        key_digest = sha512(shared_key).digest()
-        address_key = key_digest[16:32]
-        message_key = key_digest[32:48]
-        hmac_key = key_digest[:16]
-        ## 1. Encrypt The Message
-        if i==0:
-            message_cipher = aes_ctr_enc_dec(message_key, iv, message_plaintext)
-            address_cipher = aes_ctr_enc_dec(address_key, iv,
-                                     address_plaintext)
-        else:
-            message_cipher = aes_ctr_enc_dec(message_key, iv, message_ciphers[i-1])
-            address_cipher = aes_ctr_enc_dec(address_key, iv,
-                                             address_ciphers[i-1])
-        message_ciphers.append(message_cipher)
-        address_ciphers.append(address_cipher)
 
-        
-        ## 2. Encrypt the old HMACs
-        for q, mac in enumerate(hmacs):
-            iv = pack("H14s", len(hmacs)-q-1, b"\x00"*14)
-            hmacs[q] = aes_ctr_enc_dec(hmac_key, iv, mac)
+#####################################################
+# EXTENSION -- Streaming mix servers.
+#              Messages are pulled from an iterator and
+#              yielded as soon as they are decoded, so a
+#              round never needs to be held in memory.
 
-        previous_hmac_key = hmac_key
+from random import SystemRandom
 
-        ## 3. Compute the new HMAC
-        h = Hmac(b"sha512", hmac_key)
+def _decode_one_hop_stream(private_key, messages):
+    """ Decodes an iterable of OneHopMixMessages in input order. """
+    G = EcGroup()
+    aes = Cipher("AES-128-CTR")
+
+    for msg in messages:
+        if _one_hop_is_malformed(G, msg):
+            raise Exception("Malformed input message")
+        key_material = _shared_key_material(private_key, msg.ec_public_key)
+        yield _decode_one_hop(msg, key_material, aes)
+
+def mix_server_one_hop_stream(private_key, messages, shuffle_buffer=1000):
+    """ Decodes an iterable of OneHopMixMessages, yielding the (address, message)
+        tuples one at a time. Messages are only read from the iterable as the 
+        output is consumed, so a slow consumer holds back the producer.
+
+        Rather than sorting the whole round, the output is mixed through
+        a shuffle stage holding at most shuffle_buffer messages, since 
+        releasing them in arrival order would link them to their senders.
+    """
+    if not shuffle_buffer or shuffle_buffer < 1:
+        raise Exception("A one-hop mix must shuffle its output.")
+    return shuffle_stream(_decode_one_hop_stream(private_key, messages), shuffle_buffer)
+
+def mix_server_n_hop_stream(private_key, messages, final=False):
+    """ Decodes an iterable of NHopMixMessages, yielding either messages 
+        for the next mix or (address, message) tuples if final=True, 
+        one at a time and in input order. """
+    G = EcGroup()
+    aes = Cipher("AES-128-CTR")
 
-        ## Iterate backwards through the previous hmacs
-        for old_mac in hmacs[::-1]:
-            h.update(old_mac)
-        h.update(address_ciphers[i])
-        h.update(message_ciphers[i])
-        
+    for msg in messages:
+        yield _decode_n_hop(G, private_key, msg, final, aes)
+
+def shuffle_stream(items, buffer_size, rng=None):
+    """ Shuffles an iterable using a buffer of at most buffer_size items.
+
+        Each incoming item replaces a randomly chosen item of the full
+        buffer, which is yielded; the remaining buffer is shuffled and 
+        yielded at the end of the stream.
+    """
+    assert buffer_size > 0
+    if rng is None:
+        rng = SystemRandom()
 
-        new_mac = h.digest()
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer += [item]
+            continue
+        i = rng.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
 
-        hmacs.append(new_mac[:20])
-      
-    # Hmacs were built in reverse order, put them back in order
-    hmacs.reverse()
+    rng.shuffle(buffer)
+    for item in buffer:
+        yield item
 
-    return NHopMixMessage(client_public_key, hmacs, address_ciphers[len(address_ciphers)-1], message_ciphers[len(message_ciphers)-1])
 
+#####################################################
+# EXTENSION -- A binary wire format for NHopMixMessages.
+#
+# A packet has a fixed layout:
+#   1 byte          the number n of hmacs (one per remaining hop)
+#   1 + 1 or 2 * F  the EC public key, compressed or uncompressed,
+#                   where F is the size of a field element
+#   n * 20 bytes    the hmacs
+#   258 bytes       the address ciphertext
+#   1002 bytes      the message ciphertext
+# The form of the point is given by its first byte. A round is a
+# 4 byte count followed by its packets back to back.
+#
+# Parsed messages hold memoryview slices of the receive buffer
+# rather than copies of each field.
+
+_field_sizes = {}
+def _point_size(G, form_byte):
+    """ Returns the size of an encoded point, given its first byte. """
+    nid = G.nid()
+    if nid not in _field_sizes:
+        _field_sizes[nid] = len(G.generator().export()) - 1
+    if form_byte == 4:
+        return 1 + 2 * _field_sizes[nid]
+    return 1 + _field_sizes[nid]
+
+def _as_bytes(data):
+    """ Turns a memoryview slice into bytes, as required by petlib. """
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+def _export_point(point, compressed):
+    """ Exports a point in compressed or uncompressed form. """
+    if compressed:
+        return point.export()
+    return point.export(POINT_CONVERSION_UNCOMPRESSED)
+
+def n_hop_packet_size(G, hops, compressed=True):
+    """ The size of an encoded NHopMixMessage with a given number of hmacs. """
+    return 1 + _point_size(G, 2 if compressed else 4) + 20 * hops + 258 + 1002
+
+def pack_n_hop_into(buf, offset, msg, compressed=True):
+    """ Writes a NHopMixMessage into the bytearray buf at offset, 
+        and returns the offset just after it. """
+
+    # Assigning a longer field to a slice of buf would grow buf rather than fail
+    if not len(msg.hmacs) < 256 or \
+           not all(len(mac) == 20 for mac in msg.hmacs) or \
+           not len(msg.address) == 258 or \
+           not len(msg.message) == 1002:
+        raise Exception("Malformed input message")
+    end = offset + n_hop_packet_size(msg.ec_public_key.group, len(msg.hmacs), compressed)
+    if end > len(buf):
+        raise Exception("Buffer too small")
+
+    point = _export_point(msg.ec_public_key, compressed)
+    pack_into("!B", buf, offset, len(msg.hmacs))
+    offset += 1
+    for field in [point] + list(msg.hmacs) + [msg.address, msg.message]:
+        buf[offset:offset + len(field)] = field
+        offset += len(field)
+
+    if offset != end:
+        raise Exception("Packet size mismatch")
+    return offset
+
+def pack_n_hop(msg, compressed=True):
+    """ Encodes a NHopMixMessage as a packet. """
+    buf = bytearray(n_hop_packet_size(msg.ec_public_key.group, len(msg.hmacs), compressed))
+    pack_n_hop_into(buf, 0, msg, compressed)
+    return bytes(buf)
+
+def parse_n_hop(G, buf, offset=0):
+    """ Parses the packet at offset of buf. Returns a NHopMixMessage, whose
+        hmacs, address and message are memoryview slices of buf, 
+        and the offset just after the packet. """
+    view = memoryview(buf)
+    hops = unpack_from("!B", view, offset)[0]
+    offset += 1
+
+    point_size = _point_size(G, unpack_from("!B", view, offset)[0])
+    ec_public_key = EcPt.from_binary(view[offset:offset + point_size].tobytes(), G)
+    offset += point_size
+
+    hmacs = [view[offset + 20*i:offset + 20*(i+1)] for i in range(hops)]
+    offset += 20 * hops
+
+    address = view[offset:offset + 258]
+    message = view[offset + 258:offset + 1260]
+    if len(message) != 1002:
+        raise Exception("Truncated packet")
+
+    return NHopMixMessage(ec_public_key, hmacs, address, message), offset + 1260
+
+def pack_round(message_list, compressed=True):
+    """ Encodes a list of NHopMixMessages into a single buffer. """
+    sizes = [n_hop_packet_size(msg.ec_public_key.group, len(msg.hmacs), compressed)
+             for msg in message_list]
+    buf = bytearray(4 + sum(sizes))
+    pack_into("!I", buf, 0, len(message_list))
+    offset = 4
+    for msg in message_list:
+        offset = pack_n_hop_into(buf, offset, msg, compressed)
+    return bytes(buf)
+
+def parse_round(G, buf):
+    """ Parses a buffer written by pack_round into a list of NHopMixMessages. """
+    count = unpack_from("!I", buf, 0)[0]
+    offset = 4
+    message_list = []
+    for _ in range(count):
+        msg, offset = parse_n_hop(G, buf, offset)
+        message_list += [msg]
+    return message_list
+
+
+#####################################################
+# EXTENSION -- Sharded decoding of the n-hop mix over 
+#              a pool of worker processes.
+#
+
+# EC points cannot be pickled, so shards cross the process boundary
+# in the wire format. The uncompressed form is used since decompressing
+# a point costs a square root.
+
+_worker_private_key = None
+def _init_mix_worker(private_key_bytes):
+    """ Loads the mix private key once in each worker process. """
+    global _worker_private_key
+    _worker_private_key = Bn.from_binary(private_key_bytes)
+
+def _mix_n_hop_shard(args):
+    """ Decodes one shard of exported messages within a worker process. """
+    shard, final = args
+    out = mix_server_n_hop(_worker_private_key, parse_round(EcGroup(), shard), final)
+    if final:
+        return out
+    return pack_round(out, compressed=False)
+
+class MixWorkerPool(object):
+    """ A pool of worker processes that hold the private key of a mix, kept
+        for as long as the mix runs, so that process start up and key loading
+        are paid once rather than on every round. """
+
+    def __init__(self, private_key, workers=None):
+        from multiprocessing import Pool, cpu_count
+
+        if workers is None:
+            workers = cpu_count()
+        self.private_key = private_key
+        self.workers = workers
+        self.pool = Pool(workers, initializer=_init_mix_worker, initargs=(private_key.binary(),))
+
+    def close(self):
+        """ Stops the worker processes. """
+        self.pool.close()
+        self.pool.join()
+
+    def mix(self, message_list, final=False, shard_size=None):
+        """ Decodes a round, as mix_server_n_hop_parallel. """
+
+        # Packing would let a bad field spill into its neighbours, so the
+        # round is checked as mix_server_n_hop would before it is framed
+        G = EcGroup()
+        if any(_n_hop_is_malformed(G, msg) for msg in message_list):
+            raise Exception("Malformed input message")
+
+        if shard_size is None:
+            shard_size = max(1, -(-len(message_list) // (4 * self.workers)))
+
+        shards = []
+        for i in range(0, len(message_list), shard_size):
+            shards += [(pack_round(message_list[i:i+shard_size], compressed=False), final)]
+
+        results = self.pool.map(_mix_n_hop_shard, shards)
+
+        out_queue = []
+        for result in results:
+            if final:
+                out_queue += result
+            else:
+                out_queue += parse_round(G, result)
+
+        return out_queue
+
+def mix_server_n_hop_parallel(private_key, message_list, final=False, workers=None, shard_size=None, pool=None):
+    """ Decodes a round of NHopMixMessages like mix_server_n_hop, but splits 
+        the round into shards that are processed by a pool of worker processes.
+
+        A mix processing many rounds should pass its MixWorkerPool as pool,
+        otherwise a pool of workers is started and stopped for this round.
+
+        The output keeps the order of message_list, and the whole round fails 
+        if any message is malformed or fails its HMAC check.
+    """
+    if pool is not None:
+        if pool.private_key != private_key:
+            raise Exception("The pool holds another private key.")
+        return pool.mix(message_list, final, shard_size)
+
+    pool = MixWorkerPool(private_key, workers)
+    try:
+        return pool.mix(message_list, final, shard_size)
+    finally:
+        pool.pool.terminate()
+        pool.pool.join()
+
+def time_mix_server_n_hop_parallel(number_of_messages=2000, max_workers=None, rounds=5):
+    """ Prints the throughput of mix_server_n_hop and of 
+        mix_server_n_hop_parallel with 1 to max_workers processes, over
+        a number of rounds, starting a pool for each round or reusing one. """
+    import time
+    from multiprocessing import cpu_count
+
+    if max_workers is None:
+        max_workers = cpu_count()
+
+    G = EcGroup()
+    private_keys = [G.order().random() for _ in range(3)]
+    public_keys = [k * G.generator() for k in private_keys]
+
+    messages = [mix_client_n_hop(list(public_keys), urandom(256), urandom(1000))
+                for _ in range(number_of_messages)]
+
+    t1 = time.time()
+    mix_server_n_hop(private_keys[0], messages)
+    t2 = time.time()
+    print("serial     : %9.1f msg/s" % (number_of_messages / (t2 - t1)))
+
+    total = rounds * number_of_messages
+    for workers in range(1, max_workers + 1):
+        t1 = time.time()
+        for _ in range(rounds):
+            mix_server_n_hop_parallel(private_keys[0], messages, workers=workers)
+        t2 = time.time()
+        pool = MixWorkerPool(private_keys[0], workers)
+        for _ in range(rounds):
+            mix_server_n_hop_parallel(private_keys[0], messages, pool=pool)
+        t3 = time.time()
+        pool.close()
+        print("%2d workers : %9.1f msg/s with a pool per round, %9.1f msg/s reusing one" % 
+              (workers, total / (t2 - t1), total / (t3 - t2)))
 
 
 #####################################################
@@ -0,0 +1,238 @@
+#####################################################
+# GA17 Privacy Enhancing Technologies -- Lab 02
+#
+# A reference asyncio mix node built around the
+# n-hop mix of Lab02Code (requires Python 3).
+#
+# Run a local 3-hop cascade benchmark through:
+# $ python -c "from Lab02Node import *; time_cascade()"
+
+import asyncio
+import time
+from collections import namedtuple
+from random import SystemRandom
+from struct import pack, unpack
+
+from petlib.ec import EcGroup, Bn
+from petlib.cipher import Cipher
+
+from Lab02Code import mix_client_n_hop, pack_n_hop, parse_n_hop, _decode_n_hop
+
+#####################################################
+# Framing of messages on the socket.
+#
+# Each frame is a 4 byte big endian length followed by
+# a packet in the wire format of Lab02Code. Points are 
+# sent uncompressed to avoid a square root per message.
+
+def encode_frame(msg):
+    """ Encodes a NHopMixMessage into a length prefixed frame. """
+    packet = pack_n_hop(msg, compressed=False)
+    return pack("!I", len(packet)) + packet
+
+def decode_frame(G, body):
+    """ Decodes the body of a frame (without its length) into a NHopMixMessage. """
+    msg, _ = parse_n_hop(G, body)
+    return msg
+
+async def read_frame(reader):
+    """ Reads the body of the next frame, or returns None at the end of the stream. """
+    try:
+        header = await reader.readexactly(4)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = unpack("!I", header)
+    return await reader.readexactly(length)
+
+#####################################################
+# The CPU heavy part of a round. It takes and returns
+# bytes so that it can run in a thread or process pool.
+
+def mix_round(private_key_bytes, bodies, final):
+    """ Decodes a round of frame bodies. Returns the shuffled outputs, either
+        as frames for the next hop or as (address, message) tuples if final,
+        and the number of messages that were dropped as invalid. """
+    G = EcGroup()
+    aes = Cipher("AES-128-CTR")
+    private_key = Bn.from_binary(private_key_bytes)
+
+    out, dropped = [], 0
+    for body in bodies:
+        try:
+            msg = decode_frame(G, body)
+            decoded = _decode_n_hop(G, private_key, msg, final, aes)
+        except Exception:
+            dropped += 1
+            continue
+        out += [decoded if final else encode_frame(decoded)]
+
+    SystemRandom().shuffle(out)
+    return out, dropped
+
+#####################################################
+# The mix node service.
+
+RoundStats = namedtuple('RoundStats', ['size', 'dropped', 'latency', 'throughput'])
+
+class MixNode(object):
+    """ An asyncio mix node.
+
+        It accepts framed NHopMixMessages on a local TCP socket, and collects
+        them into rounds of at most threshold messages. A round is mixed as
+        soon as it is full, or timeout seconds after the previous round.
+        The decoding runs in an executor (the default thread pool, or any
+        concurrent.futures executor). Outputs are forwarded to the next_hop
+        (host, port) or, for the final node, put on the delivered queue.
+
+        For each round, stats records its size, the number of dropped
+        messages, the latency (from the arrival of its oldest message to the
+        end of forwarding) and the decoding throughput in messages per second.
+    """
+
+    def __init__(self, private_key, next_hop=None, threshold=100, timeout=1.0,
+                 executor=None, host="127.0.0.1", port=0):
+        self.private_key = private_key
+        self.next_hop = next_hop
+        self.final = next_hop is None
+        self.threshold = threshold
+        self.timeout = timeout
+        self.executor = executor
+        self.host, self.port = host, port
+
+        self.stats = []
+        self.delivered = asyncio.Queue()
+
+        self._pending = []
+        self._oldest = None
+        self._mixing = 0
+        self._closing = False
+        self._full = asyncio.Event()
+        self._server = None
+        self._rounds = None
+        self._writer = None
+
+    async def start(self):
+        """ Starts listening, and returns the (host, port) the node is bound to. """
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        if not self.final:
+            _, self._writer = await asyncio.open_connection(*self.next_hop)
+        self._rounds = asyncio.ensure_future(self._run_rounds())
+        return (self.host, self.port)
+
+    async def close(self):
+        """ Stops accepting messages, lets the round being mixed (if any)
+            finish, mixes all pending messages and stops the node. """
+        self._server.close()
+        await self._server.wait_closed()
+
+        # Rounds are never cancelled, as their messages are no longer pending
+        self._closing = True
+        self._full.set()
+        await self._rounds
+
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _handle(self, reader, writer):
+        while True:
+            body = await read_frame(reader)
+            if body is None:
+                break
+            if not self._pending:
+                self._oldest = time.time()
+            self._pending += [body]
+            if len(self._pending) >= self.threshold:
+                self._full.set()
+        writer.close()
+
+    async def _run_rounds(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+            await self._mix_pending()
+
+        while self._pending:
+            await self._mix_pending()
+
+    async def _mix_pending(self):
+        self._full.clear()
+        if not self._pending:
+            return
+
+        bodies, oldest = self._pending[:self.threshold], self._oldest
+        self._pending = self._pending[self.threshold:]
+        self._oldest = time.time()
+        if len(self._pending) >= self.threshold:
+            self._full.set()
+
+        loop = asyncio.get_event_loop()
+        self._mixing = len(bodies)
+        t1 = time.time()
+        out, dropped = await loop.run_in_executor(
+            self.executor, mix_round, self.private_key.binary(), bodies, self.final)
+        t2 = time.time()
+
+        if self.final:
+            for item in out:
+                self.delivered.put_nowait(item)
+        else:
+            self._writer.write(b"".join(out))
+            await self._writer.drain()
+
+        self.stats += [RoundStats(len(bodies), dropped, time.time() - oldest,
+                                  len(bodies) / max(t2 - t1, 1e-9))]
+        self._mixing = 0
+
+async def run_cascade(messages, private_keys, threshold=100, timeout=0.2):
+    """ Starts a cascade of local mix nodes, sends the messages to the first
+        and returns the delivered (address, message) tuples and the nodes,
+        once every message was delivered or dropped. """
+    nodes = []
+    next_hop = None
+    for private_key in reversed(private_keys):
+        node = MixNode(private_key, next_hop, threshold, timeout)
+        next_hop = await node.start()
+        nodes.insert(0, node)
+
+    _, writer = await asyncio.open_connection(*next_hop)
+    for msg in messages:
+        writer.write(encode_frame(msg))
+    await writer.drain()
+    writer.close()
+
+    # Wait until every message was either delivered or dropped by a node
+    delivered = []
+    while len(delivered) + sum(r.dropped for n in nodes for r in n.stats) < len(messages):
+        try:
+            delivered += [await asyncio.wait_for(nodes[-1].delivered.get(), timeout)]
+        except asyncio.TimeoutError:
+            pass
+
+    for node in nodes:
+        await node.close()
+    return delivered, nodes
+
+def time_cascade(number_of_messages=1000, hops=3, threshold=100):
+    """ Prints the per round latency and throughput of each node of a local
+        cascade, and the end-to-end throughput. """
+    from os import urandom
+
+    G = EcGroup()
+    private_keys = [G.order().random() for _ in range(hops)]
+    public_keys = [k * G.generator() for k in private_keys]
+    messages = [mix_client_n_hop(list(public_keys), urandom(256), urandom(1000))
+                for _ in range(number_of_messages)]
+
+    t1 = time.time()
+    delivered, nodes = asyncio.run(run_cascade(messages, private_keys, threshold))
+    t2 = time.time()
+
+    for i, node in enumerate(nodes):
+        for r in node.stats:
+            print("hop %d: %4d messages, %d dropped, latency %6.3fs, %8.1f msg/s" %
+                  (i, r.size, r.dropped, r.latency, r.throughput))
+    print("end-to-end: %d messages in %.3fs, %.1f msg/s" %
+          (len(delivered), t2 - t1, len(delivered) / (t2 - t1)))
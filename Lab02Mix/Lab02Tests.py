@@ -133,6 +133,53 @@ def test_simple_client_decode_many():
 
     assert len(res1) == 100
 
+@pytest.mark.task2
+def test_stream_decode_is_lazy():
+
+    from os import urandom
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_key = o.random()
+    public_key  = private_key * g
+
+    consumed = []
+    def messages():
+        for i in range(10):
+            consumed.append(i)
+            yield mix_client_one_hop(public_key, b"Alice", b"Message %d" % i)
+
+    # The shuffle stage only reads ahead by its buffer
+    out = mix_server_one_hop_stream(private_key, messages(), shuffle_buffer=3)
+    assert consumed == []
+    first = next(out)
+    assert first in [(b"Alice", b"Message %d" % i) for i in range(3)]
+    assert consumed == [0, 1, 2, 3]
+
+    rest = list(out)
+    assert sorted([first] + rest) == [(b"Alice", b"Message %d" % i) for i in range(10)]
+
+    with raises(Exception) as excinfo:
+        next(mix_server_one_hop_stream(private_key, messages(), shuffle_buffer=0))
+
+@pytest.mark.task2
+def test_stream_shuffle():
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_key = o.random()
+    public_key  = private_key * g
+
+    messages = [mix_client_one_hop(public_key, b"Alice", b"Message %d" % i) for i in range(20)]
+    out = list(mix_server_one_hop_stream(private_key, messages, shuffle_buffer=5))
+
+    assert sorted(out) == mix_server_one_hop(private_key, messages)
+    assert sorted(shuffle_stream(range(100), 7)) == list(range(100))
+
 ###################################
 # TASK 3 -- A multi-hop mix
 
@@ -188,6 +235,292 @@ def test_Alice_encode_3_hop():
     assert out[0][0] == address
     assert out[0][1] == message
 
+@pytest.mark.task3
+def test_Alice_encode_10_hop():
+    """
+    Test sending a multi-hop message through 10 hops
+    """
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(10)]
+    public_keys  = [pk * g for pk in private_keys]
+
+    address = b"Alice"
+    message = b"Dear Alice,\nHello!\nBob"
+
+    out = [mix_client_n_hop(public_keys, address, message)]
+    for private_key in private_keys[:-1]:
+        out = mix_server_n_hop(private_key, out)
+    out = mix_server_n_hop(private_keys[-1], out, final=True)
+
+    assert out == [(address, message)]
+
+@pytest.mark.task3
+def test_mix_client_encode_many():
+    """
+    Test encoding many messages for the same cascade
+    """
+
+    from os import urandom
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(3)]
+    public_keys  = [pk * g for pk in private_keys]
+    keys_before = list(public_keys)
+
+    sent = [(urandom(10), urandom(100)) for _ in range(10)]
+    client = MixClient(public_keys)
+    round = client.encode_many(sent)
+
+    mix_client_n_hop(public_keys, b"Alice", b"Hello")
+    assert public_keys == keys_before
+
+    out = mix_server_n_hop(private_keys[0], round)
+    out = mix_server_n_hop(private_keys[1], out)
+    out = mix_server_n_hop(private_keys[2], out, final=True)
+
+    assert out == sent
+
+@pytest.mark.task3
+def test_stream_3_hop():
+    """
+    Test chaining streaming mixes through 3 hops
+    """
+
+    from os import urandom
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(3)]
+    public_keys  = [pk * g for pk in private_keys]
+
+    sent = [(urandom(10), urandom(100)) for _ in range(10)]
+    round = (mix_client_n_hop(list(public_keys), a, m) for a, m in sent)
+
+    out = mix_server_n_hop_stream(private_keys[0], round)
+    out = mix_server_n_hop_stream(private_keys[1], out)
+    out = mix_server_n_hop_stream(private_keys[2], out, final=True)
+
+    assert list(out) == sent
+
+@pytest.mark.task3
+def test_parallel_3_hop():
+    """
+    Test mixing a round through 3 hops with a pool of workers
+    """
+
+    from os import urandom
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(3)]
+    public_keys  = [pk * g for pk in private_keys]
+
+    sent = [(urandom(10), urandom(100)) for _ in range(20)]
+    round = [mix_client_n_hop(list(public_keys), a, m) for a, m in sent]
+
+    out = mix_server_n_hop_parallel(private_keys[0], round, workers=2, shard_size=3)
+    assert len(out) == 20
+    assert out[0].ec_public_key == mix_server_n_hop(private_keys[0], round[:1])[0].ec_public_key
+
+    out = mix_server_n_hop_parallel(private_keys[1], out, workers=2)
+    out = mix_server_n_hop_parallel(private_keys[2], out, final=True, workers=2)
+
+    assert out == sent
+
+@pytest.mark.task3
+def test_parallel_pool_reuse():
+    
+    from os import urandom
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_key = o.random()
+    public_key  = private_key * g
+
+    pool = MixWorkerPool(private_key, workers=2)
+    for _ in range(3):
+        sent = [(urandom(10), urandom(100)) for _ in range(10)]
+        round = [mix_client_n_hop([public_key], a, m) for a, m in sent]
+        assert mix_server_n_hop_parallel(private_key, round, final=True, pool=pool) == sent
+
+    with raises(Exception) as excinfo:
+        mix_server_n_hop_parallel(o.random(), round, pool=pool)
+    pool.close()
+
+@pytest.mark.task3
+def test_parallel_hmac_failure():
+    
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_key = o.random()
+    public_key  = private_key * g
+
+    round = [mix_client_n_hop([public_key], b"Alice", b"Hello") for _ in range(5)]
+    round[3] = round[3]._replace(hmacs=[b"\x00"*20])
+
+    with raises(Exception) as excinfo:
+        mix_server_n_hop_parallel(private_key, round, final=True, workers=2)
+    assert 'HMAC check failure' in str(excinfo.value)
+
+@pytest.mark.task3
+def test_parallel_malformed():
+    
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_key = o.random()
+    public_key  = private_key * g
+
+    # Bad fields are rejected as by the serial mix, even when they would 
+    # pack into a packet of the right size
+    msg = mix_client_n_hop([public_key], b"Alice", b"Hello")
+    bad = [msg._replace(address=msg.address + msg.message[:1], message=msg.message[1:]),
+           msg._replace(hmacs=[msg.hmacs[0][:19]]),
+           msg._replace(hmacs=[]),
+           msg._replace(ec_public_key=msg.ec_public_key.export())]
+
+    pool = MixWorkerPool(private_key, workers=1)
+    for m in bad:
+        for mix in [lambda r: mix_server_n_hop(private_key, r, final=True),
+                    lambda r: mix_server_n_hop_parallel(private_key, r, final=True, pool=pool)]:
+            with raises(Exception) as excinfo:
+                mix([msg, m])
+            assert 'Malformed input message' in str(excinfo.value)
+    pool.close()
+
+@pytest.mark.task3
+def test_wire_format():
+    """
+    Test packing and parsing messages and rounds
+    """
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(3)]
+    public_keys  = [pk * g for pk in private_keys]
+
+    m1 = mix_client_n_hop(list(public_keys), b"Alice", b"Dear Alice,\nHello!\nBob")
+    packet = pack_n_hop(m1)
+    assert len(packet) == n_hop_packet_size(G, 3) == 1 + 29 + 60 + 258 + 1002
+
+    m2, offset = parse_n_hop(G, packet)
+    assert offset == len(packet)
+    assert m2.ec_public_key == m1.ec_public_key
+    assert m2.hmacs == m1.hmacs
+    assert m2.address == m1.address
+    assert m2.message == m1.message
+
+    round = [m1, mix_client_n_hop(list(public_keys[1:]), b"Bob", b"Hi")]
+    buf = pack_round(round, compressed=False)
+    parsed = parse_round(G, buf)
+    assert [pack_n_hop(m) for m in parsed] == [pack_n_hop(m) for m in round]
+
+    out = mix_server_n_hop(private_keys[0], parse_round(G, buf)[:1])
+    out = mix_server_n_hop(private_keys[1], parse_round(G, pack_round(out)))
+    out = mix_server_n_hop(private_keys[2], out, final=True)
+    assert out == [(b"Alice", b"Dear Alice,\nHello!\nBob")]
+
+    with raises(Exception) as excinfo:
+        parse_n_hop(G, packet[:-1])
+
+    # Fields of the wrong size cannot be packed
+    for m in [m1._replace(address=m1.address + b"\x00\x00"),
+              m1._replace(message=m1.message[:-1]),
+              m1._replace(hmacs=m1.hmacs[:2] + [m1.hmacs[2] + b"\x00"])]:
+        with raises(Exception) as excinfo:
+            pack_n_hop(m)
+        with raises(Exception) as excinfo:
+            pack_round([m1, m])
+    with raises(Exception) as excinfo:
+        pack_n_hop_into(bytearray(len(packet) - 1), 0, m1)
+
+@pytest.mark.task3
+def test_node_cascade():
+    """
+    Test a local 3-hop cascade of asyncio mix nodes
+    """
+    import asyncio
+    from os import urandom
+    from Lab02Node import run_cascade
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(3)]
+    public_keys  = [pk * g for pk in private_keys]
+
+    sent = [(urandom(10), urandom(100)) for _ in range(10)]
+    round = [mix_client_n_hop(list(public_keys), a, m) for a, m in sent]
+    round[0] = round[0]._replace(hmacs=[b"\x00"*20] + round[0].hmacs[1:])
+
+    delivered, nodes = asyncio.run(run_cascade(round[1:] + round[:1], private_keys, threshold=4, timeout=0.05))
+
+    assert sorted(delivered) == sorted(sent[1:])
+    assert sum(r.dropped for r in nodes[0].stats) == 1
+    assert sum(r.size for r in nodes[2].stats) == 9
+
+@pytest.mark.task3
+def test_node_close_during_round():
+    """
+    Test that closing a node while it mixes a round forwards the whole round
+    """
+    import asyncio
+    from Lab02Node import MixNode, encode_frame
+
+    G = EcGroup()
+    g = G.generator()
+    o = G.order()
+
+    private_keys = [o.random() for _ in range(2)]
+    public_keys  = [pk * g for pk in private_keys]
+
+    sent = [(b"Alice", b"Message %d" % i) for i in range(300)]
+    round = [mix_client_n_hop(list(public_keys), a, m) for a, m in sent]
+
+    async def scenario():
+        last = MixNode(private_keys[1], threshold=1000, timeout=0.05)
+        first = MixNode(private_keys[0], await last.start(), threshold=len(round), timeout=10)
+        first_address = await first.start()
+
+        _, writer = await asyncio.open_connection(*first_address)
+        for msg in round:
+            writer.write(encode_frame(msg))
+        await writer.drain()
+        writer.close()
+
+        # Close the first node while its single round is in the executor
+        while not first._mixing:
+            await asyncio.sleep(0.001)
+        await first.close()
+        assert [r.size for r in first.stats] == [len(round)]
+
+        delivered = []
+        while len(delivered) < len(round):
+            delivered += [await asyncio.wait_for(last.delivered.get(), 5)]
+        await last.close()
+        return delivered
+
+    assert sorted(asyncio.run(scenario())) == sorted(sent)
+
 ###########################################
 ## TASK 4 -- Simple traffic analysis / SDA
 
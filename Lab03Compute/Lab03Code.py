@@ -17,15 +17,132 @@
 ###########################
 
 
-from petlib.ec import EcGroup
+from petlib.ec import EcGroup, EcPt, POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED
 
+from hashlib import sha256
+from struct import pack, unpack_from
+import mmap
+import threading
+from collections import namedtuple, OrderedDict
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+#####################################################
+# Points hashed from labels and the parameters built 
+# from them are cached, since hashing to the curve is a 
+# try-and-increment search.
+
+class LRUCache(object):
+    """ A mapping holding at most size entries, which evicts the least 
+        recently used one, and counts its hits and misses. """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, compute):
+        """ Returns the value of key, calling compute() to get it on a miss. """
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+        else:
+            self.misses += 1
+            value = compute()
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+_hashed_points = LRUCache(256)
+def hash_to_point(G, label):
+    """ Returns G.hash_to_point(label), cached by (curve nid, label). """
+    return _hashed_points.get((G.nid(), label), lambda: G.hash_to_point(label))
+
+_setups = LRUCache(8)
 def setup():
     """Generates the Cryptosystem Parameters."""
-    G = EcGroup(nid=713)
-    g = G.hash_to_point(b"g")
-    h = G.hash_to_point(b"h")
-    o = G.order()
-    return (G, g, h, o)
+    def params():
+        G = EcGroup(nid=713)
+        g = hash_to_point(G, b"g")
+        h = hash_to_point(G, b"h")
+        o = G.order()
+        return (G, g, h, o)
+    return _setups.get((713, "setup"), params)
+
+class FixedBase(object):
+    """ Multiplies scalars by a fixed EC point. It is only kept to measure,
+        in time_fixed_base, that plain scalar * point is faster on P-224. 
+
+        With a window w, the multiples d * 2^(w*i) * base of all w bit 
+        digits d are tabulated once, and a product is the sum of one
+        table entry per w bits of the scalar. Without a window petlib's
+        own multiplication is used: on P-224 OpenSSL's constant time 
+        ladder is faster than the table (see time_fixed_base), and 
+        table lookups would depend on the bits of secret scalars.
+    """
+
+    def __init__(self, base, window=None):
+        self.base = base
+        self.window = window
+        self.table = None
+
+        if window:
+            G = base.group
+            digits = -(-G.order().num_bits() // window)
+            self.table = []
+            row_base = base
+            for _ in range(digits):
+                row = [G.infinite()]
+                for _ in range((1 << window) - 1):
+                    row += [row[-1] + row_base]
+                self.table += [row]
+                row_base = row[-1] + row_base
+
+    def mul(self, scalar):
+        """ Returns scalar * base. """
+        if not self.table:
+            return self.base.pt_mul(scalar)
+
+        G = self.base.group
+        n = int(scalar) % int(G.order())
+        mask = (1 << self.window) - 1
+        terms = []
+        for row in self.table:
+            if n & mask:
+                terms += [row[n & mask]]
+            n >>= self.window
+        if not terms:
+            return G.infinite()
+        return G.sum(terms)
+
+def time_fixed_base(windows=(4, 8, 12), number=1000):
+    """ Prints the cost of multiplying random scalars by g with 
+        Bn * EcPt and with FixedBase tables of different windows. """
+    import time
+    (G, g, h, o) = setup()
+    scalars = [o.random() for _ in range(number)]
+
+    t1 = time.time()
+    for x in scalars:
+        x * g
+    t2 = time.time()
+    print("Bn * EcPt   : %7.1f us" % (1e6 * (t2 - t1) / number))
+
+    for window in windows:
+        t0 = time.time()
+        base = FixedBase(g, window)
+        t1 = time.time()
+        for x in scalars:
+            base.mul(x)
+        t2 = time.time()
+        print("window %2d   : %7.1f us (table built in %.2fs)" % (window, 1e6 * (t2 - t1) / number, t1 - t0))
 
 def keyGen(params):
    """ Generate a private / public key pair """
@@ -43,9 +160,13 @@ def encrypt(params, pub, m):
         raise Exception("Message value to low or high.")
 
    # ADD CODE HERE
+    return _encrypt(params, pub, m)
+
+def _encrypt(params, pub, m):
+    """ Encrypt a message of any size under the public key """
     (G, g, h, o) = params
     k = o.random()
-    c = (k * g, k * pub + m * h)
+    c = Ciphertext(k * g, k * pub + m * h)
 
     return c
 
@@ -58,25 +179,388 @@ def isCiphertext(params, ciphertext):
     ret &= G.check_point(b)
     return ret
 
+#####################################################
+# EXTENSION -- Encryption with precomputed randomness.
+
+class EncryptionPool(object):
+    """ Precomputes the randomness of encryptions under pub.
+
+        A background thread keeps up to size triples (k, k * g, k * pub)
+        ready, since none of them depends on the message. Encrypting then
+        takes one triple, looks m * h up in a small table of the messages
+        in message_range (as for range, the messages that encrypt accepts),
+        and costs a single point addition. If the pool runs dry a triple 
+        is computed inline, so encryption never blocks.
+    """
+
+    def __init__(self, params, pub, size=100, message_range=(-99, 100)):
+        (G, g, h, o) = params
+        self.params, self.pub = params, pub
+        self.message_range = message_range
+
+        self.mh = {}
+        mh = message_range[0] * h
+        for m in range(*message_range):
+            self.mh[m] = mh
+            mh = mh + h
+
+        self.ready = Queue(size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._fill)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _triple(self):
+        (G, g, h, o) = self.params
+        k = o.random()
+        return k, k * g, k * self.pub
+
+    def _fill(self):
+        triple = self._triple()
+        while not self._closed.is_set():
+            try:
+                self.ready.put(triple, timeout=0.1)
+            except Full:
+                continue
+            triple = self._triple()
+
+    def close(self):
+        """ Stops the background thread. """
+        self._closed.set()
+        self._thread.join()
+
+    def take(self):
+        """ Returns a fresh triple (k, k * g, k * pub). """
+        try:
+            return self.ready.get_nowait()
+        except Empty:
+            return self._triple()
+
+    def encrypt(self, m):
+        """ Encrypt a message under the public key of the pool """
+        low, high = self.message_range
+        if not low <= m < high:
+            raise Exception("Message value to low or high.")
+        k, kg, kpub = self.take()
+        return Ciphertext(kg, kpub + self.mh[m])
+
+def time_encryption_pool(number=1000, size=1000):
+    """ Prints the online cost of encrypt against an EncryptionPool
+        holding enough precomputed triples. """
+    import time
+    params = setup()
+    priv, pub = keyGen(params)
+    messages = [i % 2 for i in range(number)]
+
+    t1 = time.time()
+    for m in messages:
+        encrypt(params, pub, m)
+    t2 = time.time()
+    print("encrypt      : %6.1f us" % (1e6 * (t2 - t1) / number))
+
+    pool = EncryptionPool(params, pub, size)
+    while not pool.ready.full():
+        time.sleep(0.01)
+    t1 = time.time()
+    for m in messages:
+        pool.encrypt(m)
+    t2 = time.time()
+    pool.close()
+    print("pool.encrypt : %6.1f us" % (1e6 * (t2 - t1) / number))
+
+#####################################################
+# EXTENSION -- Ciphertexts, their serialization and
+#              re-randomization.
+#
+# A serialized ciphertext is the encoding of a followed
+# by the encoding of b. Points are compressed by default,
+# which halves the size but costs a square root per point
+# to parse; the form of each point is given by its first 
+# byte, so both forms may be parsed without being told.
+
+class Ciphertext(namedtuple('Ciphertext', ['a', 'b'])):
+    """ An ElGamal ciphertext (a, b) = (k * g, k * pub + m * h). It is
+        a tuple, so it may be used wherever a pair of points is. """
+    __slots__ = ()
+
+    def export(self, compressed=True):
+        """ Returns the encoding of the ciphertext. """
+        form = POINT_CONVERSION_COMPRESSED if compressed else POINT_CONVERSION_UNCOMPRESSED
+        return self.a.export(form) + self.b.export(form)
+
+    @staticmethod
+    def from_binary(data, G):
+        """ Parses the encoding of a ciphertext. """
+        c, offset = _parse_ciphertext(G, data, 0)
+        if offset != len(data):
+            raise Exception("Invalid ciphertext encoding.")
+        return c
+
+## _point_size is our old friend from Lab02 (see the wire format there)
+
+_field_sizes = {}
+def _point_size(G, form_byte):
+    """ Returns the size of an encoded point, given its first byte. """
+    nid = G.nid()
+    if nid not in _field_sizes:
+        _field_sizes[nid] = len(G.generator().export()) - 1
+    if form_byte == 0:
+        return 1
+    if form_byte == 4:
+        return 1 + 2 * _field_sizes[nid]
+    return 1 + _field_sizes[nid]
+
+def _parse_ciphertext(G, data, offset):
+    points = []
+    for _ in range(2):
+        if offset >= len(data):
+            raise Exception("Truncated ciphertext.")
+        end = offset + _point_size(G, bytearray(data[offset:offset + 1])[0])
+        if end > len(data):
+            raise Exception("Truncated ciphertext.")
+        points += [EcPt.from_binary(bytes(data[offset:end]), G)]
+        offset = end
+    return Ciphertext(*points), offset
+
+def pack_ciphertexts(ciphertexts, compressed=True):
+    """ Serializes a list of ciphertexts (or pairs of points). """
+    return b"".join(Ciphertext(*c).export(compressed) for c in ciphertexts)
+
+def parse_ciphertexts(G, data):
+    """ Parses the output of pack_ciphertexts into a list of Ciphertexts. """
+    data = memoryview(data)
+    ciphertexts, offset = [], 0
+    while offset < len(data):
+        c, offset = _parse_ciphertext(G, data, offset)
+        ciphertexts += [c]
+    return ciphertexts
+
+def rerandomize(params, pub, ciphertexts, pool=None):
+    """ Re-randomizes a list of ciphertexts under pub, by adding an 
+        encryption of 0 to each. The encryptions of 0 are taken from
+        the precomputed triples of an EncryptionPool, if one is given. """
+    (G, g, h, o) = params
+    if pool is not None and pool.pub != pub:
+        raise Exception("The pool encrypts under another key.")
+
+    out = []
+    for a, b in ciphertexts:
+        if pool is not None:
+            k, kg, kpub = pool.take()
+        else:
+            k = o.random()
+            kg, kpub = k * g, k * pub
+        out += [Ciphertext(a + kg, b + kpub)]
+    return out
+
+def time_ciphertexts(number=1000):
+    """ Prints the size and the cost of serializing ciphertexts, and
+        the cost of re-randomizing them with and without a pool. """
+    import time
+    params = setup()
+    (G, g, h, o) = params
+    priv, pub = keyGen(params)
+    ciphertexts = [encrypt(params, pub, i % 2) for i in range(number)]
+
+    for compressed in [True, False]:
+        t1 = time.time()
+        data = pack_ciphertexts(ciphertexts, compressed)
+        t2 = time.time()
+        parse_ciphertexts(G, data)
+        t3 = time.time()
+        print("compressed=%-5s: %3d bytes each, pack %5.1f us, parse %6.1f us" %
+              (compressed, len(data) // number, 1e6 * (t2 - t1) / number, 1e6 * (t3 - t2) / number))
+
+    t1 = time.time()
+    rerandomize(params, pub, ciphertexts)
+    t2 = time.time()
+    pool = EncryptionPool(params, pub, number)
+    while not pool.ready.full():
+        time.sleep(0.01)
+    t3 = time.time()
+    rerandomize(params, pub, ciphertexts, pool)
+    t4 = time.time()
+    pool.close()
+    print("rerandomize: %.1f us, with a pool %.1f us" % 
+          (1e6 * (t2 - t1) / number, 1e6 * (t4 - t3) / number))
+
+class DiscreteLog(object):
+    """ Solves hm = m * h for m in the range [low, high) using the
+        baby-step giant-step algorithm.
+
+        The baby steps j * h, for 0 <= j < table_size, are tabulated once
+        by repeated point additions. A log then takes at most 
+        (high - low) / table_size giant steps, each one point addition and 
+        one table lookup. The table holds table_size encoded points and 
+        defaults to the square root of the size of the range; a smaller
+        table trades memory for more giant steps. 
+
+        A LoghTable mapped from disk may be given as the table of baby steps,
+        in which case it is not rebuilt in memory.
+    """
+
+    def __init__(self, params, low=-1000, high=1000, table_size=None, table=None):
+        (G, g, h, o) = params
+        assert low < high
+
+        self.h = h
+        self.low, self.high = low, high
+        self.shift = -low * h
+
+        if table is not None:
+            self.table = table
+            self.table_size = len(table)
+            self.giant = -self.table_size * h
+            self.steps = -(-(high - low) // self.table_size)
+            return
+
+        if table_size is None:
+            table_size = 1
+            while table_size * table_size < high - low:
+                table_size *= 2
+        self.table_size = table_size
+        self.steps = -(-(high - low) // table_size)
+
+        self.table = {}
+        baby = G.infinite()
+        for j in range(table_size):
+            self.table[baby.export()] = j
+            baby = baby + h
+
+        self.giant = baby.pt_neg()
+
+    def log(self, hm):
+        """ Returns m such that hm = m * h, or raises an exception if 
+            there is none in the range. """
+        gamma = hm + self.shift
+        for i in range(self.steps):
+            j = self.table.get(gamma.export())
+            m = None if j is None else self.low + i * self.table_size + j
+            if m is not None and m < self.high:
+                # Keys of mapped tables are truncated hashes, so confirm the hit
+                if isinstance(self.table, dict) or m * self.h == hm:
+                    return m
+            gamma = gamma + self.giant
+
+        raise Exception("No decryption found.")
+
+#####################################################
+# A table of baby steps j * h -> j, for 0 <= j < size, 
+# stored on disk so that it is computed once per params
+# and then mapped (and shared) by any number of processes.
+#
+# The file holds the magic b"LOGH", the length of the
+# encoding of h, the number of records, the encoding of h,
+# and then the records sorted by key. Each record is 12 bytes:
+# the first 8 bytes of the SHA-256 of the encoded point,
+# and j as a 4 byte unsigned integer.
+
+def _logh_key(encoded_point):
+    return sha256(encoded_point).digest()[:8]
+
+def write_logh_table(params, path, size):
+    """ Computes the baby steps j * h for 0 <= j < size and writes them to path. """
+    (G, g, h, o) = params
+    assert 0 < size < 2**32
+
+    records = []
+    baby = G.infinite()
+    for j in range(size):
+        records += [(_logh_key(baby.export()), j)]
+        baby = baby + h
+    records.sort()
+
+    h_bytes = h.export()
+    with open(path, "wb") as f:
+        f.write(b"LOGH" + pack("!BI", len(h_bytes), size) + h_bytes)
+        for key, j in records:
+            f.write(pack("!8sI", key, j))
+
+class LoghTable(object):
+    """ A table written by write_logh_table, mapped read-only into memory.
+        Lookups binary search the records in place. """
+
+    def __init__(self, params, path):
+        (G, g, h, o) = params
+
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if self.map[:4] != b"LOGH" or len(self.map) < 9:
+                raise Exception("Not a logh table.")
+            h_len, self.size = unpack_from("!BI", self.map, 4)
+            if self.map[9:9 + h_len] != h.export():
+                raise Exception("The logh table was built for other parameters.")
+            self.offset = 9 + h_len
+
+            # Lookups would read past the end of a truncated table
+            if len(self.map) != self.offset + 12 * self.size:
+                raise Exception("The logh table has the wrong size.")
+        except Exception:
+            self.map.close()
+            raise
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        self.map.close()
+
+    def get(self, encoded_point):
+        """ Returns j such that the point may be j * h, or None. """
+        key = _logh_key(encoded_point)
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self.offset + 12 * mid
+            if self.map[pos:pos + 8] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        pos = self.offset + 12 * lo
+        if lo < self.size and self.map[pos:pos + 8] == key:
+            return unpack_from("!I", self.map, pos + 8)[0]
+        return None
+
 _logh = None
-def logh(params, hm):
-    """ Compute a discrete log, for small number only """
+def logh(params, hm, dlog=None):
+    """ Compute a discrete log, for small number only (-1000 to 999),
+        unless a DiscreteLog covering a larger range is given. """
     global _logh
     (G, g, h, o) = params
 
-    # Initialize the map of logh
-    if _logh == None:
-        _logh = {}
-        for m in range (-1000, 1000):
-            _logh[(m * h)] = m
+    if dlog is not None:
+        return dlog.log(hm)
 
-    if hm not in _logh:
-        raise Exception("No decryption found.")
+    # Initialize the default table of logh
+    if _logh == None or _logh.h != h:
+        _logh = DiscreteLog(params, -1000, 1000)
+
+    return _logh.log(hm)
+
+def time_discrete_log(ranges=(10**3, 10**5, 10**7), number=20):
+    """ Prints the table build time and decryption latency of DiscreteLog
+        for plaintexts in [0, n) with the default table size. """
+    import time
+    params = setup()
+    (G, g, h, o) = params
 
-    return _logh[hm]
+    for n in ranges:
+        t1 = time.time()
+        dlog = DiscreteLog(params, 0, n)
+        t2 = time.time()
+        points = [(n - 1 - i) * h for i in range(number)]
+        t3 = time.time()
+        for hm in points:
+            dlog.log(hm)
+        t4 = time.time()
+        print("range %9d: table of %5d built in %6.3fs, %7.2f ms per log (worst case)" %
+              (n, dlog.table_size, t2 - t1, 1000 * (t4 - t3) / number))
 
-def decrypt(params, priv, ciphertext):
-    """ Decrypt a message using the private key """
+def decrypt(params, priv, ciphertext, dlog=None):
+    """ Decrypt a message using the private key. A DiscreteLog may be
+        given to decrypt messages outside the default range. """
     assert isCiphertext(params, ciphertext)
     a , b = ciphertext
 
@@ -84,7 +568,34 @@ def decrypt(params, priv, ciphertext):
     (G, g, h, o) = params
     hm = (b + (priv * a).pt_neg())
 
-    return logh(params, hm)
+    return logh(params, hm, dlog)
+
+def time_logh_table(size=2**16, path="logh_table.bin"):
+    """ Prints the cold start cost of building a DiscreteLog in memory 
+        against mapping a LoghTable of the same size from disk, and the
+        cost of a log with each. """
+    import time, os
+    params = setup()
+    (G, g, h, o) = params
+
+    write_logh_table(params, path, size)
+    hm = (size * 10 - 1) * h
+
+    t1 = time.time()
+    in_memory = DiscreteLog(params, 0, size * size, table_size=size)
+    t2 = time.time()
+    table = LoghTable(params, path)
+    mapped = DiscreteLog(params, 0, size * size, table=table)
+    t3 = time.time()
+    in_memory.log(hm)
+    t4 = time.time()
+    mapped.log(hm)
+    t5 = time.time()
+    table.close()
+    os.remove(path)
+
+    print("table of %d: in memory starts in %.3fs, mapped in %.3fs" % (size, t2 - t1, t3 - t2))
+    print("log after 10 giant steps: in memory %.2fms, mapped %.2fms" % (1000 * (t4 - t3), 1000 * (t5 - t4)))
 
 #####################################################
 # TASK 2 -- Define homomorphic addition and
@@ -132,9 +643,9 @@ def groupKey(params, pubKeys=[]):
 
     return pub
 
-def partialDecrypt(params, priv, ciphertext, final=False):
+def partialDecrypt(params, priv, ciphertext, final=False, dlog=None):
     """ Given a ciphertext and a private key, perform partial decryption. 
-        If final is True, then return the plaintext. """
+        If final is True, then return the plaintext, using dlog if given. """
     assert isCiphertext(params, ciphertext)
     
     # ADD CODE HERE
@@ -143,10 +654,84 @@ def partialDecrypt(params, priv, ciphertext, final=False):
     b1 = (b1 + (priv * a1).pt_neg())
 
     if final:
-        return logh(params, b1)
+        return logh(params, b1, dlog)
     else:
         return a1, b1
 
+#####################################################
+# EXTENSION -- Threshold decryption of many ciphertexts.
+#
+# Each authority only needs the a halves of the ciphertexts 
+# to compute its decryption shares priv * a. The shares of
+# all the authorities are then subtracted from each b at once.
+
+def decryption_shares(params, priv, ciphertexts):
+    """ Returns the decryption shares priv * a of an authority for 
+        a list of ciphertexts. """
+    for c in ciphertexts:
+        assert isCiphertext(params, c)
+    return [priv * a for a, b in ciphertexts]
+
+def combine_shares(params, ciphertexts, shares, dlog=None):
+    """ Given the decryption shares of all authorities (one list per 
+        authority), returns the plaintexts of the ciphertexts. """
+    (G, g, h, o) = params
+    plaintexts = []
+    for i, (a, b) in enumerate(ciphertexts):
+        hm = b + G.sum([s[i] for s in shares]).pt_neg()
+        plaintexts += [logh(params, hm, dlog)]
+    return plaintexts
+
+def partialDecrypt_batch(params, priv, ciphertexts, final=False, dlog=None):
+    """ Partially decrypts a list of ciphertexts with one private key.
+        If final is True, then return the plaintexts, using dlog if given. """
+    shares = decryption_shares(params, priv, ciphertexts)
+    if final:
+        return combine_shares(params, ciphertexts, [shares], dlog)
+    return [(a, b + s.pt_neg()) for (a, b), s in zip(ciphertexts, shares)]
+
+def threshold_decrypt(params, privs, ciphertexts, dlog=None, concurrent=True):
+    """ Decrypts a list of ciphertexts under the group key of the
+        authorities holding privs. The authorities compute their shares 
+        concurrently (petlib releases the GIL while in OpenSSL) unless 
+        concurrent is False, and the shares are combined once. """
+    if concurrent and len(privs) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(len(privs))
+        try:
+            shares = pool.map(lambda priv: decryption_shares(params, priv, ciphertexts), privs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        shares = [decryption_shares(params, priv, ciphertexts) for priv in privs]
+
+    return combine_shares(params, ciphertexts, shares, dlog)
+
+def time_threshold_decrypt(number_of_ciphertexts=1000, authorities=3):
+    """ Prints the time to decrypt a list of ciphertexts by chaining 
+        partialDecrypt calls against threshold_decrypt. """
+    import time
+    params = setup()
+    keys = [keyGen(params) for _ in range(authorities)]
+    privs = [priv for priv, pub in keys]
+    pub = groupKey(params, [pub for priv, pub in keys])
+    ciphertexts = [encrypt(params, pub, i % 10) for i in range(number_of_ciphertexts)]
+
+    t1 = time.time()
+    for c in ciphertexts:
+        for priv in privs[:-1]:
+            c = partialDecrypt(params, priv, c)
+        partialDecrypt(params, privs[-1], c, True)
+    t2 = time.time()
+    print("partialDecrypt chain      : %.3fs" % (t2 - t1))
+
+    for concurrent in [False, True]:
+        t1 = time.time()
+        threshold_decrypt(params, privs, ciphertexts, concurrent=concurrent)
+        t2 = time.time()
+        print("threshold_decrypt (%-5s) : %.3fs" % (concurrent, t2 - t1))
+
 #####################################################
 # TASK 4 -- Actively corrupt final authority, derives
 #           a public key with a known private key.
@@ -194,16 +779,252 @@ def process_votes(params, pub, encrypted_votes):
     assert isinstance(encrypted_votes, list)
     
     # ADD CODE HERE
-    tv0=encrypted_votes[0][0]
-    tv1=encrypted_votes[0][1]
-    for i in range (1,len(encrypted_votes)):
-        v0=encrypted_votes[i][0]
-        v1=encrypted_votes[i][1]
-        tv0 = add(params, pub, tv0, v0)
-        tv1 = add(params, pub, tv1, v1)
+    tv0, tv1 = tally(params, encrypted_votes)
             
     return tv0, tv1
 
+#####################################################
+# EXTENSION -- Tallying many encrypted ballots.
+#
+# A ballot is a sequence of ciphertexts and a tally is 
+# the list of the sums of each position over all ballots.
+
+def _sum_ciphertexts(G, ciphertexts):
+    """ Sums a non empty list of ciphertexts. """
+    return Ciphertext(G.sum([a for a, b in ciphertexts]), G.sum([b for a, b in ciphertexts]))
+
+def _tree_sum(G, tallies):
+    """ Adds a list of partial tallies pairwise, in rounds, into one tally. """
+    while len(tallies) > 1:
+        paired = []
+        for i in range(0, len(tallies) - 1, 2):
+            paired += [[_sum_ciphertexts(G, [c1, c2]) for c1, c2 in zip(tallies[i], tallies[i+1])]]
+        if len(tallies) % 2:
+            paired += [tallies[-1]]
+        tallies = paired
+    return tallies[0]
+
+def _tally_rows(params, rows):
+    """ Checks every ciphertext of a list of ballots once, and sums them. """
+    (G, g, h, o) = params
+    width = len(rows[0])
+    for row in rows:
+        if len(row) != width or not all(isCiphertext(params, c) for c in row):
+            raise Exception("Invalid ballot.")
+    return [_sum_ciphertexts(G, [row[i] for row in rows]) for i in range(width)]
+
+def _tally_shard(args):
+    """ Tallies a shard of exported ballots within a worker process. """
+    nid, shard = args
+    G = EcGroup(nid)
+    rows = [[(EcPt.from_binary(a, G), EcPt.from_binary(b, G)) for a, b in row] for row in shard]
+    total = _tally_rows((G, None, None, None), rows)
+    return [(a.export(POINT_CONVERSION_UNCOMPRESSED), b.export(POINT_CONVERSION_UNCOMPRESSED)) 
+            for a, b in total]
+
+def tally(params, ballots, workers=None, shard_size=None):
+    """ Sums a non empty list of ballots, and returns the list of the
+        ciphertexts of the sums of each position.
+
+        Every ciphertext is checked once, and each position is summed
+        in a single pass. With workers, the ballots are split into shards 
+        that are tallied by a pool of processes, and the partial tallies 
+        are then added pairwise.
+    """
+    (G, g, h, o) = params
+    assert len(ballots) > 0
+
+    if not workers:
+        return _tally_rows(params, ballots)
+
+    from multiprocessing import Pool
+    if shard_size is None:
+        shard_size = max(1, -(-len(ballots) // (4 * workers)))
+
+    U = POINT_CONVERSION_UNCOMPRESSED
+    shards = []
+    for i in range(0, len(ballots), shard_size):
+        shards += [(G.nid(), [[(a.export(U), b.export(U)) for a, b in row] 
+                              for row in ballots[i:i+shard_size]])]
+
+    pool = Pool(workers)
+    try:
+        results = pool.map(_tally_shard, shards)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    partials = [[Ciphertext(EcPt.from_binary(a, G), EcPt.from_binary(b, G)) for a, b in r] for r in results]
+    return _tree_sum(G, partials)
+
+def tally_stream(params, ballots, chunk_size=1000):
+    """ Tallies an iterable of ballots, reading at most chunk_size
+        ballots at a time. """
+    (G, g, h, o) = params
+    total = None
+    chunk = []
+    for ballot in ballots:
+        chunk += [ballot]
+        if len(chunk) == chunk_size:
+            total = _fold_chunk(params, total, chunk)
+            chunk = []
+    if chunk:
+        total = _fold_chunk(params, total, chunk)
+
+    if total is None:
+        raise Exception("No ballots to tally.")
+    return total
+
+def _fold_chunk(params, total, chunk):
+    """ Adds the tally of a chunk of ballots to a running total. """
+    (G, g, h, o) = params
+    partial = _tally_rows(params, chunk)
+    if total is None:
+        return partial
+    return _tree_sum(G, [total, partial])
+
+def time_tally(number_of_votes=10000, workers=(2, 4)):
+    """ Prints the time to tally a poll with the original pairwise add() loop,
+        with tally, with tally_stream and with tally over worker processes. """
+    import time
+    params = setup()
+    priv, pub = keyGen(params)
+    votes = [encode_vote(params, pub, i % 2) for i in range(number_of_votes)]
+
+    t1 = time.time()
+    tv0, tv1 = votes[0]
+    for v0, v1 in votes[1:]:
+        tv0, tv1 = add(params, pub, tv0, v0), add(params, pub, tv1, v1)
+    t2 = time.time()
+    print("add() loop  : %.3fs" % (t2 - t1))
+
+    t1 = time.time()
+    tally(params, votes)
+    t2 = time.time()
+    print("tally       : %.3fs" % (t2 - t1))
+
+    t1 = time.time()
+    tally_stream(params, iter(votes))
+    t2 = time.time()
+    print("tally_stream: %.3fs" % (t2 - t1))
+
+    for w in workers:
+        t1 = time.time()
+        tally(params, votes, workers=w)
+        t2 = time.time()
+        print("%d workers   : %.3fs" % (w, t2 - t1))
+
+#####################################################
+# EXTENSION -- Ballots with several questions, each 
+#              with any number of options.
+#
+# Every (question, option) pair is a counter. Counters
+# are packed in base max_voters + 1 into as few plaintexts
+# as the range of the decryption allows: a ballot with 
+# a single vote for the counter of weight base**i encrypts
+# base**i, and the sums of the counters never carry since
+# none exceeds max_voters.
+
+class BallotLayout(object):
+    """ The packing of the counters of a ballot into ciphertexts.
+
+        questions is the list of the number of options of each question.
+        Each ciphertext holds per_ciphertext counters, so that the totals 
+        are below base**per_ciphertext <= max_plaintext.
+    """
+
+    def __init__(self, questions, max_voters, max_plaintext=2**24):
+        assert all(n > 0 for n in questions)
+        self.questions = list(questions)
+        self.base = max_voters + 1
+
+        self.per_ciphertext = 1
+        while self.base ** (self.per_ciphertext + 1) <= max_plaintext:
+            self.per_ciphertext += 1
+        if self.base ** self.per_ciphertext > max_plaintext:
+            raise Exception("Too many voters for the plaintext range.")
+
+        self.counters = sum(self.questions)
+        self.width = -(-self.counters // self.per_ciphertext)
+        self._dlog = None
+
+    def encode(self, choices):
+        """ Returns the plaintexts of a ballot with one choice per question. """
+        if len(choices) != len(self.questions):
+            raise Exception("One choice per question is expected.")
+
+        plaintexts = [0] * self.width
+        first = 0
+        for choice, options in zip(choices, self.questions):
+            if not 0 <= choice < options:
+                raise Exception("Invalid choice.")
+            i = first + choice
+            plaintexts[i // self.per_ciphertext] += self.base ** (i % self.per_ciphertext)
+            first += options
+        return plaintexts
+
+    def decode(self, plaintexts):
+        """ Returns the counts of each option of each question from the
+            plaintexts of a tally. """
+        counters = []
+        for m in plaintexts:
+            for _ in range(self.per_ciphertext):
+                counters += [m % self.base]
+                m //= self.base
+
+        counts, first = [], 0
+        for options in self.questions:
+            counts += [counters[first:first + options]]
+            first += options
+        return counts
+
+    def discrete_log(self, params):
+        """ Returns the DiscreteLog, shared by all the ciphertexts of 
+            a tally, covering the range of the packed plaintexts. """
+        if self._dlog is None or self._dlog.h != params[2]:
+            self._dlog = DiscreteLog(params, 0, self.base ** self.per_ciphertext)
+        return self._dlog
+
+def encode_ballot(params, pub, layout, choices):
+    """ Encrypts a ballot as a list of layout.width ciphertexts. """
+    return [_encrypt(params, pub, m) for m in layout.encode(choices)]
+
+def tally_ballots(params, layout, encrypted_ballots, **kwargs):
+    """ Tallies the ballots in one pass over the matrix of ciphertexts. 
+        Any keyword arguments are passed on to tally. """
+    for ballot in encrypted_ballots:
+        if len(ballot) != layout.width:
+            raise Exception("Invalid ballot.")
+    return tally(params, encrypted_ballots, **kwargs)
+
+def decrypt_tally(params, priv, layout, encrypted_totals):
+    """ Decrypts a tally into the counts of each option of each question. """
+    dlog = layout.discrete_log(params)
+    return layout.decode([decrypt(params, priv, c, dlog) for c in encrypted_totals])
+
+def time_ballots(number_of_voters=1000, questions=(10, 10, 10)):
+    """ Prints the number of ciphertexts per voter and the time to encode, 
+        tally and decrypt a poll, with one counter per ciphertext
+        as in encode_vote against the packed layout. """
+    import time
+    from random import randrange
+    params = setup()
+    priv, pub = keyGen(params)
+    choices = [[randrange(n) for n in questions] for _ in range(number_of_voters)]
+
+    for name, max_plaintext in [("unpacked", number_of_voters + 1), ("packed", 2**24)]:
+        layout = BallotLayout(questions, number_of_voters, max_plaintext)
+        t1 = time.time()
+        ballots = [encode_ballot(params, pub, layout, c) for c in choices]
+        t2 = time.time()
+        totals = tally_ballots(params, layout, ballots)
+        t3 = time.time()
+        decrypt_tally(params, priv, layout, totals)
+        t4 = time.time()
+        print("%-8s: %2d ciphertexts per voter, encode %.3fs, tally %.3fs, decrypt %.3fs" %
+              (name, layout.width, t2 - t1, t3 - t2, t4 - t3))
+
 def simulate_poll(votes):
     """ Simulates the full process of encrypting votes,
         tallying them, and then decrypting the total. """
@@ -227,12 +1048,7 @@ def simulate_poll(votes):
 
     # Simulate threshold decryption
     privs = [priv1, priv2, priv3]
-    for priv in privs[:-1]:
-        total_v0 = partialDecrypt(params, priv, total_v0)
-        total_v1 = partialDecrypt(params, priv, total_v1)
-
-    total_v0 = partialDecrypt(params, privs[-1], total_v0, True)
-    total_v1 = partialDecrypt(params, privs[-1], total_v1, True)
+    total_v0, total_v1 = threshold_decrypt(params, privs, [total_v0, total_v1])
 
     # Return the plaintext values
     return total_v0, total_v1
@@ -40,6 +40,140 @@ def test_decrypt():
     assert decrypt(params, priv, encrypt(params, pub, -2)) == -2
     assert decrypt(params, priv, encrypt(params, pub, 99)) == 99
 
+@pytest.mark.task1
+def test_encryption_pool():
+    params = setup()
+    priv, pub = keyGen(params)
+
+    pool = EncryptionPool(params, pub, size=5)
+    for m in [0, 99, -99, 1, 2, 3, 4, 5, 6, 7]:
+        assert decrypt(params, priv, pool.encrypt(m)) == m
+    with raises(Exception) as excinfo:
+        pool.encrypt(1000)
+    pool.close()
+
+    # Messages are checked against the range of the pool
+    pool = EncryptionPool(params, pub, size=1, message_range=(0, 1000))
+    assert decrypt(params, priv, pool.encrypt(500)) == 500
+    for m in [-1, 1000]:
+        with raises(Exception) as excinfo:
+            pool.encrypt(m)
+    pool.close()
+
+@pytest.mark.task1
+def test_ciphertext():
+    params = setup()
+    (G, g, h, o) = params
+    priv, pub = keyGen(params)
+
+    cs = [encrypt(params, pub, m) for m in [0, 5, -5]]
+    cs += [(G.infinite(), pub)]
+    assert Ciphertext.from_binary(cs[0].export(), G) == cs[0]
+    assert len(cs[0].export()) == 58
+
+    for compressed in [True, False]:
+        data = pack_ciphertexts(cs, compressed)
+        assert parse_ciphertexts(G, data) == cs
+        with raises(Exception) as excinfo:
+            parse_ciphertexts(G, data[:-1])
+
+    pool = EncryptionPool(params, pub, size=2)
+    for p in [None, pool]:
+        cs2 = rerandomize(params, pub, cs[:3], p)
+        assert [c2.a != c.a for c, c2 in zip(cs, cs2)] == [True] * 3
+        assert [decrypt(params, priv, c) for c in cs2] == [0, 5, -5]
+    pool.close()
+
+@pytest.mark.task1
+def test_hash_to_point_cache():
+    from Lab03Code import _hashed_points
+    params = setup()
+    (G, g, h, o) = params
+    assert setup() is params
+
+    cache = LRUCache(2)
+    hits, misses = _hashed_points.hits, _hashed_points.misses
+    assert hash_to_point(G, b"g") == g
+    assert hash_to_point(G, b"test label") == G.hash_to_point(b"test label")
+    assert hash_to_point(G, b"test label") == G.hash_to_point(b"test label")
+    assert (_hashed_points.hits - hits, _hashed_points.misses - misses) == (2, 1)
+
+    for key in ["a", "b", "a", "c", "b"]:
+        cache.get(key, lambda: key.upper())
+    assert list(cache.entries.items()) == [("c", "C"), ("b", "B")]
+    assert (cache.hits, cache.misses) == (1, 4)
+
+@pytest.mark.task1
+def test_fixed_base():
+    params = setup()
+    (G, g, h, o) = params
+
+    table = FixedBase(g, window=4)
+    for x in [0, 1, 15, 16, -1, o.random(), o - 1]:
+        assert table.mul(x) == x * g
+        assert FixedBase(g).mul(x) == x * g
+
+@pytest.mark.task1
+def test_discrete_log():
+    params = setup()
+    (G, g, h, o) = params
+
+    dlog = DiscreteLog(params, -50, 3000, table_size=10)
+    for m in [-50, -1, 0, 1, 9, 10, 2999]:
+        assert dlog.log(m * h) == m
+    with raises(Exception) as excinfo:
+        dlog.log(3000 * h)
+    with raises(Exception) as excinfo:
+        dlog.log(-51 * h)
+
+    with raises(Exception) as excinfo:
+        decrypt(params, o.random(), encrypt(params, h, 0))
+
+@pytest.mark.task1
+def test_decrypt_large():
+    params = setup()
+    priv, pub = keyGen(params)
+
+    dlog = DiscreteLog(params, 0, 2 * 10**6)
+    c = mul(params, pub, encrypt(params, pub, 99), 20000)
+    assert decrypt(params, priv, c, dlog) == 1980000
+    with raises(Exception) as excinfo:
+        decrypt(params, priv, c)
+
+@pytest.mark.task1
+def test_logh_table(tmpdir):
+    params = setup()
+    (G, g, h, o) = params
+    priv, pub = keyGen(params)
+
+    path = str(tmpdir.join("logh.bin"))
+    write_logh_table(params, path, 100)
+    table = LoghTable(params, path)
+    assert len(table) == 100
+    assert table.get((37 * h).export()) == 37
+    assert table.get((100 * h).export()) is None
+
+    dlog = DiscreteLog(params, -500, 10000, table=table)
+    for m in [-500, -1, 0, 99, 100, 9999]:
+        assert dlog.log(m * h) == m
+    with raises(Exception) as excinfo:
+        dlog.log(10000 * h)
+
+    c = mul(params, pub, encrypt(params, pub, 99), 100)
+    assert decrypt(params, priv, c, dlog) == 9900
+
+    table.close()
+
+    with raises(Exception) as excinfo:
+        LoghTable((G, h, g, o), path)
+
+    # A truncated table is refused rather than searched out of bounds
+    with open(path, "r+b") as f:
+        f.truncate(9 + len(h.export()) + 12 * 99)
+    with raises(Exception) as excinfo:
+        LoghTable(params, path)
+    assert 'wrong size' in str(excinfo.value)
+
 #####################################################
 # TASK 2 -- Define homomorphic addition and
 #           multiplication with a public value
@@ -107,6 +241,24 @@ def test_partial():
     m = partialDecrypt(params, priv2, cprime, True)
     assert m == 0
 
+@pytest.mark.task3
+def test_partial_batch():
+    params = setup()
+    keys = [keyGen(params) for _ in range(3)]
+    privs = [priv for priv, pub in keys]
+    pub = groupKey(params, [pub for priv, pub in keys])
+
+    messages = [10, -3, 0, 99]
+    cs = [encrypt(params, pub, m) for m in messages]
+
+    partial = cs
+    for priv in privs[:-1]:
+        partial = partialDecrypt_batch(params, priv, partial)
+    assert partialDecrypt_batch(params, privs[-1], partial, True) == messages
+
+    assert threshold_decrypt(params, privs, cs) == messages
+    assert threshold_decrypt(params, privs, cs, concurrent=False) == messages
+
 #####################################################
 # TASK 4 -- Actively corrupt final authority, derives
 #           a public key with a known private key.
@@ -144,4 +296,43 @@ def test_poll():
     votes = [1, 0, 1, 0, 1, 1, 0, 1, 1, 1]
     v0, v1 = simulate_poll(votes)
     assert v0 == 3
-    assert v1 == 7
\ No newline at end of file
+    assert v1 == 7
+
+@pytest.mark.task5
+def test_tally():
+    params = setup()
+    priv, pub = keyGen(params)
+
+    votes = [1, 0, 1, 0, 1, 1, 0, 1, 1, 1, 0]
+    encrypted_votes = [encode_vote(params, pub, v) for v in votes]
+
+    for total in [tally(params, encrypted_votes),
+                  tally(params, encrypted_votes, workers=2, shard_size=3),
+                  tally_stream(params, iter(encrypted_votes), chunk_size=4)]:
+        assert [decrypt(params, priv, c) for c in total] == [4, 7]
+        assert all(isinstance(c, Ciphertext) for c in total)
+    assert isinstance(process_votes(params, pub, encrypted_votes)[0], Ciphertext)
+
+    bad_votes = encrypted_votes + [(encrypted_votes[0][0],)]
+    with raises(Exception) as excinfo:
+        tally(params, bad_votes)
+
+@pytest.mark.task5
+def test_ballots():
+    params = setup()
+    priv, pub = keyGen(params)
+
+    layout = BallotLayout([3, 5, 2], max_voters=10, max_plaintext=10**4)
+    assert layout.per_ciphertext == 3
+    assert layout.width == 4
+
+    choices = [[0, 4, 1], [2, 4, 0], [0, 1, 1], [1, 0, 1]]
+    ballots = [encode_ballot(params, pub, layout, c) for c in choices]
+    totals = tally_ballots(params, layout, ballots)
+
+    counts = decrypt_tally(params, priv, layout, totals)
+    assert counts == [[2, 1, 1], [1, 1, 0, 0, 2], [1, 3]]
+
+    with raises(Exception) as excinfo:
+        layout.encode([3, 0, 0])
+
@@ -10,19 +10,65 @@
 # Group Members: Killian Davitt, Lizhou Feng
 ###########################
 
-from petlib.ec import EcGroup
+from petlib.ec import EcGroup, EcPt
 from petlib.bn import Bn
 
 from hashlib import sha256
-from binascii import hexlify
-
+from struct import pack
+from os import urandom
+import threading
+from collections import OrderedDict
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+## LRUCache and the cached hash_to_point and setup are 
+## our old friends from Lab03
+
+class LRUCache(object):
+    """ A mapping holding at most size entries, which evicts the least 
+        recently used one, and counts its hits and misses. """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, compute):
+        """ Returns the value of key, calling compute() to get it on a miss. """
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+        else:
+            self.misses += 1
+            value = compute()
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+_hashed_points = LRUCache(256)
+def hash_to_point(G, label):
+    """ Returns G.hash_to_point(label), cached by (curve nid, label). """
+    return _hashed_points.get((G.nid(), label), lambda: G.hash_to_point(label))
+
+_setups = LRUCache(8)
 def setup():
-    """ Generates the Cryptosystem Parameters. """
-    G = EcGroup(nid=713)
-    g = G.hash_to_point(b"g")
-    hs = [G.hash_to_point(("h%s" % i).encode("utf8")) for i in range(4)]
-    o = G.order()
-    return (G, g, hs, o)
+    """ Generates the Cryptosystem Parameters. The points are cached, but
+        each call gets its own list hs. """
+    def params():
+        G = EcGroup(nid=713)
+        g = hash_to_point(G, b"g")
+        hs = [hash_to_point(G, ("h%s" % i).encode("utf8")) for i in range(4)]
+        o = G.order()
+        return (G, g, hs, o)
+    G, g, hs, o = _setups.get((713, "setup"), params)
+    return (G, g, list(hs), o)
 
 def keyGen(params):
    """ Generate a private / public key pair. """
@@ -31,43 +77,194 @@ def keyGen(params):
    pub = priv * g
    return (priv, pub)
 
-def to_challenge(elements):
-    """ Generates a Bn challenge by hashing a number of EC points """
-    Cstring = b",".join([hexlify(x.export()) for x in elements])
-    Chash =  sha256(Cstring).digest()
-    return Bn.from_binary(Chash)
+class Transcript(object):
+    """ The SHA-256 state of a Fiat-Shamir challenge.
+
+        Each point is absorbed as its compressed encoding preceded by its 
+        length in two bytes, so distinct lists of points never hash alike.
+        A transcript of the fixed points of a statement may be kept and 
+        copied for each challenge, rather than hashing them again.
+    """
+
+    def __init__(self, elements=()):
+        self.state = sha256()
+        self.absorb(elements)
+
+    def absorb(self, elements):
+        """ Absorbs a list of EC points. """
+        for x in elements:
+            data = x.export()
+            self.state.update(pack("!H", len(data)) + data)
+        return self
+
+    def copy(self):
+        t = Transcript()
+        t.state = self.state.copy()
+        return t
+
+    def challenge(self, elements=()):
+        """ Returns the Bn challenge for this transcript followed by elements,
+            leaving this transcript unchanged. """
+        return Bn.from_binary(self.copy().absorb(elements).state.digest())
+
+_transcripts = {}
+def fixed_transcript(elements):
+    """ Returns a Transcript of a list of points, cached for as long as 
+        the same point objects (such as those of params) are given. """
+    key = tuple(id(x) for x in elements)
+    cached = _transcripts.get(key)
+    if cached is None or any(x is not y for x, y in zip(cached[0], elements)):
+        if len(_transcripts) >= 64:
+            _transcripts.clear()
+        cached = (list(elements), Transcript(elements))
+        _transcripts[key] = cached
+    return cached[1]
+
+def to_challenge(elements, fixed=()):
+    """ Generates a Bn challenge by hashing a number of EC points, after 
+        the fixed points of the statement, whose hash state is cached. 
+        to_challenge(elements, fixed) == to_challenge(fixed + elements) """
+    return fixed_transcript(fixed).challenge(elements)
+
+def time_to_challenge(number=10000):
+    """ Prints the cost of a challenge over the params and one point,
+        hashing everything against reusing the cached params. """
+    import time
+    params = setup()
+    (G, g, (h0, h1, h2, h3), o) = params
+    W = o.random() * g
+
+    t1 = time.time()
+    for _ in range(number):
+        to_challenge([g, h0, h1, h2, h3, W])
+    t2 = time.time()
+    for _ in range(number):
+        to_challenge([W], [g, h0, h1, h2, h3])
+    t3 = time.time()
+    print("all points: %.1f us, cached params: %.1f us" % 
+          (1e6 * (t2 - t1) / number, 1e6 * (t3 - t2) / number))
+
+def multi_mul(scalars, points):
+    """ Computes Sum si * Pi in a single pass. 
+
+        It uses OpenSSL's EC_POINTs_mul (through petlib's wsum), which 
+        interleaves the windowed NAF expansions of all scalars (Straus), so 
+        the doublings are shared rather than done once per term. Scalars
+        may be Bn or ints, and negative.
+    """
+    assert len(scalars) == len(points)
+    if not points:
+        raise Exception("No points to sum.")
+    G = points[0].group
+    return G.wsum([s if isinstance(s, Bn) else Bn.from_num(s) for s in scalars], points)
 
 #####################################################
 # TASK 1 -- Prove knowledge of a DH public key's 
 #           secret.
 
-def proveKey(params, priv, pub):
+def proveKey(params, priv, pub, commitment_form=False):
     """ Uses the Schnorr non-interactive protocols produce a proof 
         of knowledge of the secret priv such that pub = priv * g.
 
         Outputs: a proof (c, r)
                  c (a challenge)
                  r (the response)
+
+        If commitment_form is True the proof is (W, r) instead, where 
+        W is the commitment the challenge is derived from. Such proofs
+        can be checked in batches by verifyKey_batch.
     """  
     (G, g, hs, o) = params
     
     ## YOUR CODE HERE:
     w = o.random()
-    W = w*g
-    c=to_challenge([g, W]) 
+    W = w * g
+    c=to_challenge([W], [g]) 
     r = (w-c*priv)% o
     
+    if commitment_form:
+        return (W, r)
     return (c, r)
 
 def verifyKey(params, pub, proof):
     """ Schnorr non-interactive proof verification of knowledge of a a secret.
         Returns a boolean indicating whether the verification was successful.
+        Accepts proofs in either form produced by proveKey.
     """
     (G, g, hs, o) = params
     c, r = proof
-    gw_prime  = c * pub + r * g 
+    if isinstance(c, EcPt):
+        return verifyKey_batch(params, [(pub, proof)]) == [True]
+
+    gw_prime  = multi_mul([c, r], [pub, g])
    
-    return to_challenge([g, gw_prime]) == c
+    return to_challenge([gw_prime], [g]) == c
+
+def verifyKey_batch(params, proofs):
+    """ Verifies a list of (pub, proof) pairs at once, and returns a list 
+        of booleans indicating which of the proofs are valid.
+
+        Proofs in commitment form (W, r) must satisfy W = c * pub + r * g 
+        with c = H(g, W). Each equation is weighted by a fresh random 128 bit
+        factor and all are summed into a single multi-scalar multiplication,
+        which is the identity if all proofs are valid (and, with overwhelming
+        probability, only then). When it is not, the batch is split in 
+        halves that are checked in turn to find the invalid proofs.
+        Proofs in (c, r) form cannot be batched and are verified one by one.
+    """
+    (G, g, hs, o) = params
+    results = [False] * len(proofs)
+
+    equations = []
+    for i, (pub, proof) in enumerate(proofs):
+        W, r = proof
+        if not isinstance(W, EcPt):
+            results[i] = verifyKey(params, pub, proof)
+        elif G.check_point(W) and G.check_point(pub):
+            equations += [(i, pub, W, r, to_challenge([W], [g]))]
+
+    def check(batch):
+        rhos = [Bn.from_binary(urandom(16)) for _ in batch]
+        scalars = [(rho * r) % o for rho, (_, _, _, r, _) in zip(rhos, batch)]
+        scalars = [sum(scalars, Bn(0)) % o]
+        points = [g]
+        for rho, (_, pub, W, _, c) in zip(rhos, batch):
+            scalars += [(rho * c) % o, o - rho]
+            points += [pub, W]
+        return multi_mul(scalars, points).is_infinite()
+
+    _bisect(equations, check, results)
+    return results
+
+def _bisect(batch, check, results):
+    """ Sets results[eq[0]] for the equations eq of the batch that pass, 
+        by checking the whole batch and splitting it in halves on failure. """
+    if not batch:
+        return
+    if check(batch):
+        for eq in batch:
+            results[eq[0]] = True
+    elif len(batch) > 1:
+        _bisect(batch[:len(batch) // 2], check, results)
+        _bisect(batch[len(batch) // 2:], check, results)
+
+def time_verifyKey_batch(sizes=(10, 100, 1000)):
+    """ Prints the cost per proof of verifyKey and of verifyKey_batch. """
+    import time
+    params = setup()
+
+    for size in sizes:
+        keys = [keyGen(params) for _ in range(size)]
+        proofs = [(pub, proveKey(params, priv, pub, commitment_form=True)) for priv, pub in keys]
+
+        t1 = time.time()
+        for pub, proof in proofs:
+            verifyKey(params, pub, proof)
+        t2 = time.time()
+        assert all(verifyKey_batch(params, proofs))
+        t3 = time.time()
+        print("%5d proofs: %7.1f us / proof one by one, %7.1f us / proof batched" % 
+              (size, 1e6 * (t2 - t1) / size, 1e6 * (t3 - t2) / size))
 
 #####################################################
 # TASK 2 -- Prove knowledge of a Discrete Log 
@@ -82,7 +279,7 @@ def commit(params, secrets):
     (G, g, (h0, h1, h2, h3), o) = params
     x0, x1, x2, x3 = secrets
     r = o.random()
-    C = x0 * h0 + x1 * h1 + x2 * h2 + x3 * h3 + r * g
+    C = multi_mul([x0, x1, x2, x3, r], [h0, h1, h2, h3, g])
     return (C, r)
 
 def proveCommitment(params, C, r, secrets):
@@ -103,8 +300,8 @@ def proveCommitment(params, C, r, secrets):
     w3 = o.random()
     wr = o.random()
     
-    W = w0*h0+w1*h1+w2*h2+w3*h3+wr*g
-    c = to_challenge([g, h0, h1, h2, h3, W])
+    W = multi_mul([w0, w1, w2, w3, wr], [h0, h1, h2, h3, g])
+    c = to_challenge([W], [g, h0, h1, h2, h3])
     
     r0=w0-c*x0
     r1=w1-c*x1
@@ -123,8 +320,8 @@ def verifyCommitments(params, C, proof):
     c, responses = proof
     (r0, r1, r2, r3, rr) = responses
 
-    Cw_prime = c * C + r0 * h0 + r1 * h1 + r2 * h2 + r3 * h3 + rr * g
-    c_prime = to_challenge([g, h0, h1, h2, h3, Cw_prime])
+    Cw_prime = multi_mul([c, r0, r1, r2, r3, rr], [C, h0, h1, h2, h3, g])
+    c_prime = to_challenge([Cw_prime], [g, h0, h1, h2, h3])
     return c_prime == c
 
 #####################################################
@@ -149,7 +346,7 @@ def proveDLEquality(params, x, K, L):
     Kw = w * g
     Lw = w * h0
 
-    c = to_challenge([g, h0, Kw, Lw])
+    c = to_challenge([Kw, Lw], [g, h0])
 
     r = (w - c * x) % o
     return (c, r)
@@ -160,10 +357,10 @@ def verifyDLEquality(params, K, L, proof):
     c, r = proof
 
     ## YOUR CODE HERE:
-    Kw_prime = c*K+r*g
-    Lw_prime = c*L+r*h0
+    Kw_prime = multi_mul([c, r], [K, g])
+    Lw_prime = multi_mul([c, r], [L, h0])
     
-    return to_challenge([g,h0,Kw_prime,Lw_prime]) == c
+    return to_challenge([Kw_prime, Lw_prime], [g, h0]) == c
 
 #####################################################
 # TASK 4 -- Prove correct encryption and knowledge of 
@@ -190,10 +387,10 @@ def proveEnc(params, pub, Ciphertext, k, m):
     w1 = o.random()
     w2 = o.random()
     
-    W1 = w1*g
-    W2 = w1*pub+w2*h0
+    W1 = w1 * g
+    W2 = multi_mul([w1, w2], [pub, h0])
 
-    c = to_challenge([g, h0, pub, W1,W2])
+    c = to_challenge([W1, W2], [g, h0, pub])
     
     rk = w1-c*k
     rm = w2-c*m
@@ -207,10 +404,81 @@ def verifyEnc(params, pub, Ciphertext, proof):
     (c, (rk, rm)) = proof
 
     ## YOUR CODE HERE:
-    W1 = c*a+rk*g
-    W2 = c*b+rk*pub+rm*h0
+    W1 = multi_mul([c, rk], [a, g])
+    W2 = multi_mul([c, rk, rm], [b, pub, h0])
     
-    return to_challenge([g,h0,pub,W1,W2]) == c
+    return to_challenge([W1, W2], [g, h0, pub]) == c
+
+#####################################################
+# EXTENSION -- Encryption with precomputed randomness.
+#
+## EncryptionPool is our old friend from Lab03, except
+## that it encrypts with h0 and returns the randomness 
+## too, like encrypt above.
+
+class EncryptionPool(object):
+    """ Precomputes the randomness of encryptions under pub.
+
+        A background thread keeps up to size triples (k, k * g, k * pub)
+        ready, since none of them depends on the message. Encrypting then
+        takes one triple, looks m * h up in a small table of the messages
+        in message_range, and costs a single point addition. If the pool
+        runs dry a triple is computed inline, so encryption never blocks.
+    """
+
+    def __init__(self, params, pub, size=100, message_range=(-99, 100)):
+        (G, g, (h, h1, h2, h3), o) = params
+        self.params, self.pub = params, pub
+
+        self.mh = {}
+        mh = message_range[0] * h
+        for m in range(*message_range):
+            self.mh[m] = mh
+            mh = mh + h
+
+        self.ready = Queue(size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._fill)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _triple(self):
+        (G, g, hs, o) = self.params
+        k = o.random()
+        return k, k * g, k * self.pub
+
+    def _fill(self):
+        triple = self._triple()
+        while not self._closed.is_set():
+            try:
+                self.ready.put(triple, timeout=0.1)
+            except Full:
+                continue
+            triple = self._triple()
+
+    def close(self):
+        """ Stops the background thread. """
+        self._closed.set()
+        self._thread.join()
+
+    def take(self):
+        """ Returns a fresh triple (k, k * g, k * pub). """
+        try:
+            return self.ready.get_nowait()
+        except Empty:
+            return self._triple()
+
+    def _mul_h(self, m):
+        (G, g, (h, h1, h2, h3), o) = self.params
+        mh = self.mh.get(m)
+        return m * h if mh is None else mh
+
+    def encrypt(self, m):
+        """ Encrypt a message m under the public key of the pool. 
+            Returns both the randomness and the ciphertext.
+        """
+        k, kg, kpub = self.take()
+        return k, (kg, kpub + self._mul_h(m))
 
 #####################################################
 # TASK 5 -- Prove a linear relation
@@ -224,7 +492,7 @@ def relation(params, x1):
     r = o.random()
 
     x0 = (10 * x1 + 20)
-    C = r * g + x1 * h1 + x0 * h0
+    C = multi_mul([r, x1, x0], [g, h1, h0])
 
     return C, x0, x1, r
 
@@ -237,8 +505,8 @@ def prove_x0eq10x1plus20(params, C, x0, x1, r):
     w1 = o.random()
     wr = o.random()
  
-    W = w1*h1+w1*10*h0+wr*g
-    c = to_challenge([g, h1, h0, W])
+    W = multi_mul([w1, 10 * w1, wr], [h1, h0, g])
+    c = to_challenge([W], [g, h1, h0])
      
     r1 = w1-c*x1
     rr = wr-c*r
@@ -251,9 +519,161 @@ def verify_x0eq10x1plus20(params, C, proof):
 
     ## YOUR CODE HERE:
     c,(r1,rr)=proof 
-    W = r1*h1+r1*10*h0+rr*g+c*(C-20*h0)
+    W = multi_mul([r1, 10 * r1 - 20 * c, rr, c], [h1, h0, g, C])
     
-    return  c == to_challenge([g, h1, h0, W])
+    return  c == to_challenge([W], [g, h1, h0])
+
+#####################################################
+# EXTENSION -- Proofs of any linear relation.
+#
+# A LinearStatement describes, with names, the equations
+# P = Sum x_j * B_j between public points P and B_j and
+# secrets x_j. Its prover and verifier follow TASK 2 for 
+# any such statement; relations with constants, like the
+# one above, become linear by moving the constant terms
+# into the public points.
+
+class LinearStatement(object):
+    """ NIZK{(secrets): lhs = Sum secret * base, for each equation}
+
+        equations is a list of (lhs, [(secret, base), ...]) of names. The 
+        points are given to prove and verify as a dict from names to points.
+        The points named in fixed (such as those of params) are hashed first
+        into the challenge, through a cached transcript. The prover commits
+        to each equation with a single multiplication or multi_mul. Each
+        equation is checked with a single multi_mul, and verify_batch 
+        checks many proofs with a single multi_mul, in which terms over 
+        the same point objects are merged.
+
+        For example, proveKey is:
+        LinearStatement(["priv"], [("pub", [("priv", "g")])], fixed=["g"])
+    """
+
+    def __init__(self, secrets, equations, fixed=()):
+        self.secrets = list(secrets)
+        self.equations = [(lhs, list(terms)) for lhs, terms in equations]
+        self.fixed = list(fixed)
+
+        names = set()
+        for lhs, terms in self.equations:
+            names.add(lhs)
+            for secret, base in terms:
+                if secret not in self.secrets:
+                    raise Exception("Unknown secret %s." % secret)
+                names.add(base)
+        self.public = [n for n in sorted(names) if n not in self.fixed]
+
+    def _challenge(self, points, Ws):
+        return to_challenge([points[n] for n in self.public] + Ws, 
+                            [points[n] for n in self.fixed])
+
+    def _commit(self, points, ws, terms):
+        if len(terms) == 1:
+            secret, base = terms[0]
+            return ws[secret] * points[base]
+        return multi_mul([ws[s] for s, b in terms], [points[b] for s, b in terms])
+
+    def prove(self, params, points, secrets, commitment_form=False):
+        """ Proves the statement for the points, given the dict of secrets.
+            Returns the challenge and the responses (in the order of the
+            secrets), or the commitments and the responses if
+            commitment_form is True, so that the proof may be batched. """
+        (G, g, hs, o) = params
+        ws = dict((s, o.random()) for s in self.secrets)
+        Ws = [self._commit(points, ws, terms) for lhs, terms in self.equations]
+        c = self._challenge(points, Ws)
+        rs = [(ws[s] - c * secrets[s]) % o for s in self.secrets]
+        return (Ws, rs) if commitment_form else (c, rs)
+
+    def verify(self, params, points, proof):
+        """ Verifies a proof of the statement for the points. """
+        (G, g, hs, o) = params
+        c, rs = proof
+        if isinstance(c, list):
+            return self.verify_batch(params, [(points, proof)]) == [True]
+
+        if len(rs) != len(self.secrets):
+            return False
+        if not all(G.check_point(points[n]) for n in self.public):
+            return False
+
+        r = dict(zip(self.secrets, rs))
+        Ws = [multi_mul([c] + [r[s] for s, b in terms], [points[lhs]] + [points[b] for s, b in terms])
+              for lhs, terms in self.equations]
+        return self._challenge(points, Ws) == c
+
+    def verify_batch(self, params, instances):
+        """ Verifies a list of (points, proof) pairs, and returns a list of
+            booleans indicating which of the proofs are valid. 
+
+            As in verifyKey_batch, each equation W = c * lhs + Sum r * base of
+            each proof in commitment form is weighted by a random 128 bit
+            factor, and the batch is bisected if their sum does not vanish.
+        """
+        (G, g, hs, o) = params
+        results = [False] * len(instances)
+
+        checks = []
+        for i, (points, proof) in enumerate(instances):
+            Ws, rs = proof
+            if not isinstance(Ws, list):
+                results[i] = self.verify(params, points, proof)
+            elif len(Ws) == len(self.equations) and len(rs) == len(self.secrets) and \
+                 all(G.check_point(x) for x in [points[n] for n in self.public] + Ws):
+                checks += [(i, points, Ws, dict(zip(self.secrets, rs)), self._challenge(points, Ws))]
+
+        def check(batch):
+            terms = {}
+            def add(scalar, point):
+                term = terms.setdefault(id(point), [Bn(0), point])
+                term[0] = (term[0] + scalar) % o
+            for _, points, Ws, r, c in batch:
+                for (lhs, eq_terms), W in zip(self.equations, Ws):
+                    rho = Bn.from_binary(urandom(16))
+                    add(rho * c, points[lhs])
+                    for s, b in eq_terms:
+                        add(rho * r[s], points[b])
+                    add(o - rho, W)
+            return multi_mul([t[0] for t in terms.values()], [t[1] for t in terms.values()]).is_infinite()
+
+        _bisect(checks, check, results)
+        return results
+
+def time_linear_statement(number=100):
+    """ Prints the cost per proof of proveEnc / verifyEnc against the same
+        statement through a LinearStatement, verified one by one and in
+        a batch. """
+    import time
+    params = setup()
+    (G, g, (h0, h1, h2, h3), o) = params
+    priv, pub = keyGen(params)
+    enc = LinearStatement(["k", "m"], [("a", [("k", "g")]), ("b", [("k", "pub"), ("m", "h0")])], 
+                          fixed=["g", "h0", "pub"])
+
+    encs = [encrypt(params, pub, i) for i in range(number)]
+    instances = [dict(g=g, h0=h0, pub=pub, a=c[0], b=c[1]) for k, c in encs]
+
+    t1 = time.time()
+    proofs = [proveEnc(params, pub, c, k, i) for i, (k, c) in enumerate(encs)]
+    t2 = time.time()
+    for (k, c), proof in zip(encs, proofs):
+        verifyEnc(params, pub, c, proof)
+    t3 = time.time()
+    print("proveEnc    : %6.1f us, verifyEnc    : %6.1f us" % 
+          (1e6 * (t2 - t1) / number, 1e6 * (t3 - t2) / number))
+
+    t1 = time.time()
+    proofs = [enc.prove(params, points, dict(k=k, m=i)) for i, ((k, c), points) in enumerate(zip(encs, instances))]
+    t2 = time.time()
+    for points, proof in zip(instances, proofs):
+        enc.verify(params, points, proof)
+    t3 = time.time()
+    proofs = [enc.prove(params, points, dict(k=k, m=i), True) for i, ((k, c), points) in enumerate(zip(encs, instances))]
+    t4 = time.time()
+    enc.verify_batch(params, list(zip(instances, proofs)))
+    t5 = time.time()
+    print("enc.prove   : %6.1f us, enc.verify   : %6.1f us, verify_batch: %6.1f us" % 
+          (1e6 * (t2 - t1) / number, 1e6 * (t3 - t2) / number, 1e6 * (t5 - t4) / number))
 
 #####################################################
 # TASK 6 -- (OPTIONAL) Prove that a ciphertext is either 0 or 1
@@ -267,21 +687,149 @@ def binencrypt(params, pub, m):
     k = o.random()
     return k, (k * g, k * pub + m * h0)
 
-def provebin(params, pub, Ciphertext, k, m):
-    """ Prove a ciphertext is valid and encrypts a binary value either 0 or 1. """
-    pass
+def provebin(params, pub, Ciphertext, k, m, commitment_form=False):
+    """ Prove a ciphertext is valid and encrypts a binary value either 0 or 1. 
+
+        For each j in [0, 1] the statement is a = k * g and b - j * h0 = k * pub.
+        As in prove_something, the proof for the branch 1 - m is simulated
+        from its challenge, and the challenges of both branches must sum 
+        to the hash. Returns (c0, c1, r0, r1), or the commitments, c0, r0
+        and r1 if commitment_form is True, so that it may be batched.
+    """
+    (G, g, (h0, h1, h2, h3), o) = params
+    a, b = Ciphertext
+    assert m in [0, 1]
+
+    # Simulate the proof for the other branch
+    j = 1 - m
+    cs, rs, Ws = [None, None], [None, None], [None, None]
+    cs[j], rs[j] = o.random(), o.random()
+    Ws[j] = (multi_mul([rs[j], cs[j]], [g, a]), 
+             multi_mul([rs[j], cs[j], (-cs[j] * j) % o], [pub, b, h0]))
+
+    # Build the proof for the real branch
+    w = o.random()
+    Ws[m] = (w * g, w * pub)
+
+    W = [Ws[0][0], Ws[0][1], Ws[1][0], Ws[1][1]]
+    c = to_challenge([a, b] + W, [g, h0, pub])
+    cs[m] = (c - cs[j]) % o
+    rs[m] = (w - cs[m] * k) % o
+
+    if commitment_form:
+        return (W, cs[0], rs[0], rs[1])
+    return (cs[0], cs[1], rs[0], rs[1])
 
 def verifybin(params, pub, Ciphertext, proof):
     """ verify that proof that a cphertext is a binary value 0 or 1. """
-    pass
+    (G, g, (h0, h1, h2, h3), o) = params
+    if isinstance(proof[0], list):
+        return verifybin_batch(params, pub, [Ciphertext], [proof]) == [True]
+
+    a, b = Ciphertext
+    if not (G.check_point(a) and G.check_point(b)):
+        return False
+
+    c0, c1, r0, r1 = proof
+    W = [multi_mul([r0, c0], [g, a]),
+         multi_mul([r0, c0], [pub, b]),
+         multi_mul([r1, c1], [g, a]),
+         multi_mul([r1, c1, o - c1], [pub, b, h0])]
+
+    return to_challenge([a, b] + W, [g, h0, pub]) % o == (c0 + c1) % o
+
+def verifybin_batch(params, pub, Ciphertexts, proofs):
+    """ Verifies a list of binary ciphertexts under pub and their proofs,
+        and returns a list of booleans indicating which of them are valid. 
+
+        As in verifyKey_batch, the four equations of each proof in commitment 
+        form are weighted by random 128 bit factors and summed into a single 
+        multi_mul, where the terms over g, h0 and pub are merged. The batch is
+        bisected if the sum does not vanish.
+    """
+    (G, g, (h0, h1, h2, h3), o) = params
+    results = [False] * len(proofs)
+
+    equations = []
+    for i, (Ciphertext, proof) in enumerate(zip(Ciphertexts, proofs)):
+        if not isinstance(proof[0], list):
+            results[i] = verifybin(params, pub, Ciphertext, proof)
+            continue
+        a, b = Ciphertext
+        W, c0, r0, r1 = proof
+        if len(W) == 4 and all(G.check_point(x) for x in [a, b] + W):
+            c1 = (to_challenge([a, b] + W, [g, h0, pub]) - c0) % o
+            equations += [(i, a, b, W, c0, c1, r0, r1)]
+
+    def check(batch):
+        sg, spub, sh0 = Bn(0), Bn(0), Bn(0)
+        scalars, points = [], []
+        for _, a, b, W, c0, c1, r0, r1 in batch:
+            rho = [Bn.from_binary(urandom(16)) for _ in range(4)]
+            sg += rho[0] * r0 + rho[2] * r1
+            spub += rho[1] * r0 + rho[3] * r1
+            sh0 += rho[3] * c1
+            scalars += [(rho[0] * c0 + rho[2] * c1) % o, (rho[1] * c0 + rho[3] * c1) % o]
+            scalars += [o - x for x in rho]
+            points += [a, b] + W
+        scalars += [sg % o, spub % o, (-sh0) % o]
+        points += [g, pub, h0]
+        return multi_mul(scalars, points).is_infinite()
+
+    _bisect(equations, check, results)
+    return results
+
+def time_verifybin_batch(sizes=(10, 100, 1000)):
+    """ Prints the cost per ballot of verifybin and of verifybin_batch. """
+    import time
+    params = setup()
+    priv, pub = keyGen(params)
+
+    for n in sizes:
+        encs = [binencrypt(params, pub, i % 2) for i in range(n)]
+        cs = [c for k, c in encs]
+        proofs = [provebin(params, pub, c, k, i % 2) for i, (k, c) in enumerate(encs)]
+        batch_proofs = [provebin(params, pub, c, k, i % 2, True) for i, (k, c) in enumerate(encs)]
+
+        t1 = time.time()
+        for c, proof in zip(cs, proofs):
+            verifybin(params, pub, c, proof)
+        t2 = time.time()
+        verifybin_batch(params, pub, cs, batch_proofs)
+        t3 = time.time()
+        print("%5d ballots: verifybin %6.1f us, verifybin_batch %6.1f us" % 
+              (n, 1e6 * (t2 - t1) / n, 1e6 * (t3 - t2) / n))
 
 def test_bin_correct():
     """ Test that a correct proof verifies """
-    pass
+    params = setup()
+    priv, pub = keyGen(params)
+
+    for m in [0, 1]:
+        k, Ciphertext = binencrypt(params, pub, m)
+        proof = provebin(params, pub, Ciphertext, k, m)
+        assert verifybin(params, pub, Ciphertext, proof)
+        proof = provebin(params, pub, Ciphertext, k, m, commitment_form=True)
+        assert verifybin(params, pub, Ciphertext, proof)
 
 def test_bin_incorrect():
     """ Prove that incorrect proofs fail. """
-    pass
+    params = setup()
+    (G, g, (h0, h1, h2, h3), o) = params
+    priv, pub = keyGen(params)
+
+    # An encryption of 2 cannot be proven binary
+    k = o.random()
+    Ciphertext = (k * g, k * pub + 2 * h0)
+    for m in [0, 1]:
+        proof = provebin(params, pub, Ciphertext, k, m)
+        assert not verifybin(params, pub, Ciphertext, proof)
+
+    # A proof does not verify for another ciphertext
+    k, Ciphertext = binencrypt(params, pub, 1)
+    k2, Ciphertext2 = binencrypt(params, pub, 1)
+    proof = provebin(params, pub, Ciphertext, k, 1)
+    assert not verifybin(params, pub, Ciphertext2, proof)
 
 #####################################################
 # TASK Q1 - Answer the following question:
@@ -40,10 +40,56 @@ def test_provekey_incorrect():
     proof2 = proveKey(params, priv2, pub2)
     assert not verifyKey(params, pub, proof2)
 
+@pytest.mark.task1
+def test_to_challenge():
+    params = setup()
+    (G, g, (h0, h1, h2, h3), o) = params
+    W = o.random() * g
+
+    c = to_challenge([W], [g, h0])
+    assert c == to_challenge([g, h0, W])
+    assert c == to_challenge([W], [g, h0])
+    assert c != to_challenge([W], [g, h1])
+    assert c == Transcript([g]).absorb([h0]).challenge([W])
+
+@pytest.mark.task1
+def test_provekey_batch():
+    params = setup()
+
+    keys = [keyGen(params) for _ in range(9)]
+    proofs = [(pub, proveKey(params, priv, pub, commitment_form=True)) for priv, pub in keys]
+    assert verifyKey(params, proofs[0][0], proofs[0][1])
+    assert verifyKey_batch(params, proofs) == [True] * 9
+
+    # Swap in bad proofs, and a proof in (c, r) form
+    priv, pub = keys[0]
+    proofs[2] = (keys[3][1], proofs[2][1])
+    proofs[7] = (proofs[7][0], (proofs[7][1][0], proofs[7][1][1] + 1))
+    proofs[5] = (keys[5][1], proveKey(params, keys[5][0], keys[5][1]))
+    assert verifyKey_batch(params, proofs) == [True] * 2 + [False] + [True] * 4 + [False, True]
+    assert not verifyKey(params, proofs[2][0], proofs[2][1])
+
 #####################################################
 # TASK 2 -- Prove knowledge of a Discrete Log 
 #           representation.
 
+@pytest.mark.task2
+def test_multi_mul():
+    params = setup()
+    (G, g, hs, o) = params
+
+    scalars = [o.random(), -5, 0, o.random() - o, 7]
+    points = [g] + hs
+    expected = scalars[0] * g
+    for x, P in zip(scalars[1:], hs):
+        expected = expected + x * P
+
+    assert multi_mul(scalars, points) == expected
+
+    # The cached params are not shared through hs
+    hs.pop()
+    assert len(setup()[2]) == 4
+
 @pytest.mark.task2
 def test_proveCommit_correct():
     params = setup()
@@ -121,6 +167,19 @@ def test_proveEnc_incorrect():
     proof = proveEnc(params, pub, ciphertext, k, 10)
     assert not verifyEnc(params, pub, ciphertext2, proof)
 
+@pytest.mark.task4
+def test_encryption_pool():
+    params = setup()
+    priv, pub = keyGen(params)
+
+    pool = EncryptionPool(params, pub, size=2)
+    for m in [10, 1000, 0]:
+        k, c = pool.encrypt(m)
+        assert c == (k * params[1], k * pub + m * params[2][0])
+        proof = proveEnc(params, pub, c, k, m)
+        assert verifyEnc(params, pub, c, proof)
+    pool.close()
+
 #####################################################
 # TASK 5 -- Prove a linear relation
 #
@@ -139,3 +198,48 @@ def test_proveRel_incorrect():
     C, x0, x1, r = relation(params, 20)
     proof = prove_x0eq10x1plus20(params, C, x1, x0, r)
     assert not verify_x0eq10x1plus20(params, C, proof)
+
+@pytest.mark.task5
+def test_linear_statement():
+    params = setup()
+    (G, g, (h0, h1, h2, h3), o) = params
+
+    # The relation of TASK 5, as C - 20 * h0 = r * g + x1 * (10 * h0 + h1)
+    stmt = LinearStatement(["r", "x1"], [("C'", [("r", "g"), ("x1", "H")])], fixed=["g", "h0", "h1"])
+
+    instances, secrets = [], []
+    for x1 in [0, 1, 40]:
+        C, x0, x1, r = relation(params, x1)
+        instances += [{"g": g, "h0": h0, "h1": h1, "C'": C - 20 * h0, "H": 10 * h0 + h1}]
+        secrets += [{"r": r, "x1": x1}]
+
+    for points, x in zip(instances, secrets):
+        assert stmt.verify(params, points, stmt.prove(params, points, x))
+        assert stmt.verify(params, points, stmt.prove(params, points, x, commitment_form=True))
+
+    proofs = [stmt.prove(params, points, x, True) for points, x in zip(instances, secrets)]
+    bad = dict(instances[1])
+    bad["C'"] = bad["C'"] + g
+    assert stmt.verify_batch(params, list(zip(instances, proofs))) == [True] * 3
+    assert stmt.verify_batch(params, list(zip([instances[0], bad, instances[2]], proofs))) == [True, False, True]
+    assert not stmt.verify(params, bad, stmt.prove(params, instances[1], secrets[1]))
+
+#####################################################
+# TASK 6 -- (OPTIONAL) Prove that a ciphertext is either 0 or 1
+
+@pytest.mark.task6
+def test_bin_batch():
+    params = setup()
+    (G, g, (h0, h1, h2, h3), o) = params
+    priv, pub = keyGen(params)
+
+    encs = [binencrypt(params, pub, m) for m in [0, 1, 1, 0, 1]]
+    cs = [c for k, c in encs]
+    proofs = [provebin(params, pub, c, k, m, True) for (k, c), m in zip(encs, [0, 1, 1, 0, 1])]
+    assert verifybin_batch(params, pub, cs, proofs) == [True] * 5
+
+    # Corrupt the third ballot into an encryption of 2, and give a proof in (c, r) form
+    cs[2] = (cs[2][0], cs[2][1] + h0)
+    proofs[3] = provebin(params, pub, cs[3], encs[3][0], 0)
+    assert verifybin_batch(params, pub, cs, proofs) == [True, True, False, True, True]
+
@@ -10,26 +10,70 @@
 # Group Members: TODO
 ###########################
 
-from petlib.ec import EcGroup
+from petlib.ec import EcGroup, EcPt, POINT_CONVERSION_UNCOMPRESSED
 from petlib.bn import Bn
 
 from hashlib import sha256
-from binascii import hexlify
+from struct import pack, unpack_from
+from os import urandom
+import os
+import mmap
+import threading
+from collections import OrderedDict
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
 
 #####################################################
 # Background, setup, key derivation and utility 
 # functions.
 # 
 
+## LRUCache and the cached hash_to_point and setup are 
+## our old friends from Lab03
+
+class LRUCache(object):
+    """ A mapping holding at most size entries, which evicts the least 
+        recently used one, and counts its hits and misses. """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, compute):
+        """ Returns the value of key, calling compute() to get it on a miss. """
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+        else:
+            self.misses += 1
+            value = compute()
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+_hashed_points = LRUCache(256)
+def hash_to_point(G, label):
+    """ Returns G.hash_to_point(label), cached by (curve nid, label). """
+    return _hashed_points.get((G.nid(), label), lambda: G.hash_to_point(label))
+
+_setups = LRUCache(8)
 def credential_setup():
     """ Generates the parameters of the algebraic MAC scheme"""
-    G = EcGroup()
-    g = G.hash_to_point(b"g")
-    h = G.hash_to_point(b"h")
-    o = G.order()
-
-    params = (G, g, h, o)
-    return params
+    def params():
+        G = EcGroup()
+        g = hash_to_point(G, b"g")
+        h = hash_to_point(G, b"h")
+        o = G.order()
+        return (G, g, h, o)
+    return _setups.get((EcGroup().nid(), "credential_setup"), params)
 
 def credential_KeyGenIssuer(params):
     """ Generates keys and parameters for the credential issuer for 1 attribute"""
@@ -38,7 +82,7 @@ def credential_KeyGenIssuer(params):
     # Generate x0, x1 as the keys to the algebraic MAC scheme
     x0, x1 = o.random(), o.random()
     sk = [x0, x1]
-    iparams = x1 * h 
+    iparams = x1 * h
 
     # Generate a pedersen commitment Cx0 to x0 with opening x0_bar
     x0_bar = o.random()
@@ -53,13 +97,73 @@ def credential_KeyGenUser(params):
     pub = priv * g # This is just an EC El-Gamal key
     return (priv, pub)
 
-## This is our old friend "to_challenge" from Lab04 on Zero Knowledge
-
-def to_challenge(elements):
-    """ Generates a Bn challenge by hashing a number of EC points """
-    Cstring = b",".join([hexlify(x.export()) for x in elements])
-    Chash =  sha256(Cstring).digest()
-    return Bn.from_binary(Chash)
+## This is our old friend "to_challenge" from Lab04 on Zero Knowledge,
+## along with the Transcript it hashes with
+
+class Transcript(object):
+    """ The SHA-256 state of a Fiat-Shamir challenge.
+
+        Each point is absorbed as its compressed encoding preceded by its 
+        length in two bytes, so distinct lists of points never hash alike.
+        A transcript of the fixed points of a statement may be kept and 
+        copied for each challenge, rather than hashing them again.
+    """
+
+    def __init__(self, elements=()):
+        self.state = sha256()
+        self.absorb(elements)
+
+    def absorb(self, elements):
+        """ Absorbs a list of EC points. """
+        for x in elements:
+            data = x.export()
+            self.state.update(pack("!H", len(data)) + data)
+        return self
+
+    def copy(self):
+        t = Transcript()
+        t.state = self.state.copy()
+        return t
+
+    def challenge(self, elements=()):
+        """ Returns the Bn challenge for this transcript followed by elements,
+            leaving this transcript unchanged. """
+        return Bn.from_binary(self.copy().absorb(elements).state.digest())
+
+_transcripts = {}
+def fixed_transcript(elements):
+    """ Returns a Transcript of a list of points, cached for as long as 
+        the same point objects (such as those of params) are given. """
+    key = tuple(id(x) for x in elements)
+    cached = _transcripts.get(key)
+    if cached is None or any(x is not y for x, y in zip(cached[0], elements)):
+        if len(_transcripts) >= 64:
+            _transcripts.clear()
+        cached = (list(elements), Transcript(elements))
+        _transcripts[key] = cached
+    return cached[1]
+
+def to_challenge(elements, fixed=()):
+    """ Generates a Bn challenge by hashing a number of EC points, after 
+        the fixed points of the statement, whose hash state is cached. 
+        to_challenge(elements, fixed) == to_challenge(fixed + elements) """
+    return fixed_transcript(fixed).challenge(elements)
+
+## As is multi_mul
+
+def multi_mul(scalars, points):
+    """ Computes Sum si * Pi in a single pass. 
+
+        It uses OpenSSL's EC_POINTs_mul (through petlib's wsum), which 
+        interleaves the windowed NAF expansions of all scalars (Straus), so 
+        the doublings are shared rather than done once per term. Scalars
+        may be Bn or ints, and negative.
+    """
+    assert len(scalars) == len(points)
+    if not points:
+        raise Exception("No points to sum.")
+    G = points[0].group
+    return G.wsum([s if isinstance(s, Bn) else Bn.from_num(s) for s in scalars], points)
 
 #####################################################
 # TASK 1 -- User Encrypts a secret value v and sends
@@ -90,7 +194,16 @@ def credential_EncryptUserSecret(params, pub, priv):
     #                     b = k * pub + v * g and 
     #                     pub = priv * g}
 
-    ## TODO
+    wk, wv, wpriv = o.random(), o.random(), o.random()
+    Wa = wk * g
+    Wb = multi_mul([wk, wv], [pub, g])
+    Wpub = wpriv * g
+
+    c = to_challenge([a, b, Wa, Wb, Wpub], [g, pub])
+
+    rk = (wk - c * k) % o
+    rv = (wv - c * v) % o
+    rpriv = (wpriv - c * priv) % o
 
     # Return the fresh v, the encryption of v and the proof.
     proof = (c, rk, rv, rpriv)
@@ -107,11 +220,11 @@ def credential_VerifyUserSecret(params, pub, ciphertext, proof):
     (c, rk, rv, rpriv) = proof
 
     # Verify knowledge of the encrypted k, v and priv
-    Wap = c * a + rk * g
-    Wbp = c * b + rk * pub + rv * g
-    Wpubp = c * pub + rpriv * g
+    Wap = multi_mul([c, rk], [a, g])
+    Wbp = multi_mul([c, rk, rv], [b, pub, g])
+    Wpubp = multi_mul([c, rpriv], [pub, g])
 
-    cp = to_challenge([g, pub, a, b, Wap, Wbp, Wpubp])
+    cp = to_challenge([a, b, Wap, Wbp, Wpubp], [g, pub])
     return cp == c
 
 
@@ -124,9 +237,11 @@ def credential_VerifyUserSecret(params, pub, ciphertext, proof):
 ## IMPRTANT NOTE: Study the section "Issuance" p.8 
 #  of https://eprint.iacr.org/2013/516.pdf
 
-def credential_Issuing(params, pub, ciphertext, issuer_params):
+def credential_Issuing(params, pub, ciphertext, issuer_params, pre=None):
     """ A function used by the credential issuer to provide a MAC
-        on a secret (encrypted) attribute v """
+        on a secret (encrypted) attribute v. The randomness and the
+        commitments that do not depend on the request may be given
+        as pre (see issuing_precompute). """
 
     G, g, h, o = params
     
@@ -142,12 +257,15 @@ def credential_Issuing(params, pub, ciphertext, issuer_params):
     # 2) Create a X1b as X1b == b * X1 == (b * x1) * h
     #     and x1b = (b * x1) mod o 
     
-    # TODO 1 & 2
+    if pre is None:
+        pre = issuing_precompute(params, issuer_params)
+    (beta, u, X1b, x1b, r_prime, r_prime_g, x0u, ws, Ws_fixed, ws3g, ws4u) = pre
 
     # 3) The encrypted MAC is u, and an encrypted u_prime defined as 
     #    E( (b*x0) * g + (x1 * b * v) * g ) + E(0; r_prime)
     
-    # TODO 3
+    new_a = r_prime_g + x1b * a
+    new_b = multi_mul([r_prime, x1b], [pub, b]) + x0u
 
     ciphertext = new_a, new_b
 
@@ -161,12 +279,45 @@ def credential_Issuing(params, pub, ciphertext, issuer_params):
     #       new_b = r_prime * pub + x1b * b + x0 * u 
     #       Cx0 = x0 * g + x0_bar * h }
 
-    ## TODO proof
+    secrets = [x1, beta, x1b, r_prime, x0, x0_bar]
+
+    Ws = Ws_fixed[:4] + [ws3g + ws[2] * a,
+                         multi_mul([ws[3], ws[2]], [pub, b]) + ws4u,
+                         Ws_fixed[4]]
+
+    c = to_challenge([pub, a, b, X1b, new_a, new_b] + Ws, [g, h, X1, Cx0])
+    rs = [(w - c * x) % o for w, x in zip(ws, secrets)]
 
     proof = (c, rs, X1b) # Where rs are multiple responses
 
     return u, ciphertext, proof
 
+def issuing_precompute(params, issuer_params):
+    """ Returns the parts of an issuance that do not depend on the request: 
+        beta, u, X1b, x1b, r_prime, r_prime * g, x0 * u, the witnesses ws
+        of the proof, the commitments of the five clauses that do not 
+        involve the request, ws[3] * g and ws[4] * u. """
+    G, g, h, o = params
+    (Cx0, iparams), (sk, x0_bar) = issuer_params
+    X1 = iparams
+    x0, x1 = sk
+
+    beta = o.random()
+    u = beta * g
+    X1b = beta * X1
+    x1b = (beta * x1) % o
+    r_prime = o.random()
+
+    ws = [o.random() for _ in range(6)]
+    Ws_fixed = [ws[0] * h,
+                ws[1] * X1,
+                ws[2] * h,
+                ws[1] * g,
+                multi_mul([ws[4], ws[5]], [g, h])]
+
+    return (beta, u, X1b, x1b, r_prime, r_prime * g, x0 * u,
+            ws, Ws_fixed, ws[3] * g, ws[4] * u)
+
 def credential_Verify_Issuing(params, issuer_pub_params, pub, u, Enc_v, Enc_u_prime, proof):
     """ User verifies that the proof associated with the issuance 
         of the credential is valid. """
@@ -184,15 +335,15 @@ def credential_Verify_Issuing(params, issuer_pub_params, pub, u, Enc_v, Enc_u_pr
     ## The proof of correctness
     (c, rs, X1b) = proof
 
-    c_prime = to_challenge([g, h, pub, a, b, X1, X1b, new_a, new_b, Cx0,
-                    c * X1 + rs[0] * h,
-                    c * X1b + rs[1] * X1,
-                    c * X1b + rs[2] * h,
-                    c * u + rs[1] * g,
-                    c * new_a + rs[3] * g + rs[2] * a,
-                    c * new_b + rs[3] * pub + rs[2] * b + rs[4] * u,
-                    c * Cx0 + rs[4] * g + rs[5] * h
-                    ])
+    c_prime = to_challenge([pub, a, b, X1b, new_a, new_b,
+                    multi_mul([c, rs[0]], [X1, h]),
+                    multi_mul([c, rs[1]], [X1b, X1]),
+                    multi_mul([c, rs[2]], [X1b, h]),
+                    multi_mul([c, rs[1]], [u, g]),
+                    multi_mul([c, rs[3], rs[2]], [new_a, g, a]),
+                    multi_mul([c, rs[3], rs[2], rs[4]], [new_b, pub, b, u]),
+                    multi_mul([c, rs[4], rs[5]], [Cx0, g, h])
+                    ], [g, h, X1, Cx0])
 
     return c_prime == c
 
@@ -204,6 +355,158 @@ def credential_Decrypt(params, priv, u, Enc_u_prime):
     u_prime = new_b - priv * new_a
     return (u, u_prime)
 
+#####################################################
+# EXTENSION -- An issuer service with precomputed 
+#              randomness.
+
+def _export_point(pt):
+    return pt.export(POINT_CONVERSION_UNCOMPRESSED)
+
+def _export_issuer_params(issuer_params):
+    (Cx0, X1), ((x0, x1), x0_bar) = issuer_params
+    return (_export_point(Cx0), _export_point(X1)), ((x0.binary(), x1.binary()), x0_bar.binary())
+
+def _import_issuer_params(G, data):
+    (Cx0, X1), ((x0, x1), x0_bar) = data
+    return ((EcPt.from_binary(Cx0, G), EcPt.from_binary(X1, G)), 
+            ([Bn.from_binary(x0), Bn.from_binary(x1)], Bn.from_binary(x0_bar)))
+
+def _init_issuer_worker(issuer_params_bytes, size):
+    """ Loads the params and the issuer keys once in each worker process, 
+        and starts the precomputation of the worker. """
+    global _worker_service
+    params = credential_setup()
+    _worker_service = IssuerService(params, _import_issuer_params(params[0], issuer_params_bytes), size)
+
+def _issue_shard(shard):
+    """ Serves a shard of exported (pub, a, b) requests within a worker process. """
+    G = _worker_service.params[0]
+    out = []
+    for pub, a, b in shard:
+        pub, a, b = [EcPt.from_binary(x, G) for x in (pub, a, b)]
+        u, (new_a, new_b), (c, rs, X1b) = _worker_service.issue(pub, (a, b))
+        out += [(_export_point(u), _export_point(new_a), _export_point(new_b),
+                 c.binary(), [r.binary() for r in rs], _export_point(X1b))]
+    return out
+
+class IssuerService(object):
+    """ A credential issuer that holds its keys, and keeps up to size 
+        issuing_precompute tuples ready in a background thread, so that
+        serving a request only costs the few multiplications that depend
+        on the ciphertext and pub of the user. If the pool runs dry a 
+        tuple is computed inline. With workers, a pool of processes is 
+        started once, each holding its own copy of the issuer keys and 
+        precomputing its own tuples, to serve issue_many.
+    """
+
+    def __init__(self, params, issuer_params, size=100, workers=None):
+        self.params = params
+        self.issuer_params = issuer_params
+        self.workers = workers
+
+        # Start the processes before the thread, so as not to fork it
+        self._pool = None
+        if workers:
+            from multiprocessing import Pool
+            self._pool = Pool(workers, initializer=_init_issuer_worker, 
+                initargs=(_export_issuer_params(issuer_params), size))
+
+        self.ready = Queue(size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._fill)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self):
+        pre = issuing_precompute(self.params, self.issuer_params)
+        while not self._closed.is_set():
+            try:
+                self.ready.put(pre, timeout=0.1)
+            except Full:
+                continue
+            pre = issuing_precompute(self.params, self.issuer_params)
+
+    def close(self):
+        """ Stops the background thread and the worker processes. """
+        self._closed.set()
+        self._thread.join()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def issue(self, pub, ciphertext):
+        """ Issues a credential, as credential_Issuing. """
+        try:
+            pre = self.ready.get_nowait()
+        except Empty:
+            pre = None
+        return credential_Issuing(self.params, pub, ciphertext, self.issuer_params, pre)
+
+    def issue_many(self, requests, shard_size=None):
+        """ Issues credentials for a list of (pub, ciphertext) requests. If the
+            service has workers, the requests are served in shards by its 
+            pool of processes. """
+        if self._pool is None:
+            return [self.issue(pub, ciphertext) for pub, ciphertext in requests]
+
+        G, g, h, o = self.params
+        if shard_size is None:
+            shard_size = max(1, -(-len(requests) // (4 * self.workers)))
+
+        exported = [(_export_point(pub), _export_point(a), _export_point(b)) 
+                    for pub, (a, b) in requests]
+        shards = [exported[i:i + shard_size] for i in range(0, len(exported), shard_size)]
+        results = self._pool.map(_issue_shard, shards)
+
+        issued = []
+        for shard in results:
+            for u, new_a, new_b, c, rs, X1b in shard:
+                u, new_a, new_b, X1b = [EcPt.from_binary(x, G) for x in (u, new_a, new_b, X1b)]
+                issued += [(u, (new_a, new_b), 
+                            (Bn.from_binary(c), [Bn.from_binary(r) for r in rs], X1b))]
+        return issued
+
+def time_issuer_service(number=200, workers=(2, 4)):
+    """ Prints the cost per credential of credential_Issuing, of an 
+        IssuerService with its pool filled, and of issue_many over worker 
+        processes. """
+    import time
+    params = credential_setup()
+    issuer_params = credential_KeyGenIssuer(params)
+    requests = []
+    for _ in range(number):
+        priv, pub = credential_KeyGenUser(params)
+        v, ciphertext, proof = credential_EncryptUserSecret(params, pub, priv)
+        requests += [(pub, ciphertext)]
+
+    t1 = time.time()
+    for pub, ciphertext in requests:
+        credential_Issuing(params, pub, ciphertext, issuer_params)
+    t2 = time.time()
+    print("credential_Issuing : %7.1f us" % (1e6 * (t2 - t1) / number))
+
+    # Stop refilling once the pool is full, so as to time the online part only
+    service = IssuerService(params, issuer_params, number)
+    while not service.ready.full():
+        time.sleep(0.01)
+    service.close()
+    t1 = time.time()
+    service.issue_many(requests)
+    t2 = time.time()
+    print("IssuerService.issue: %7.1f us" % (1e6 * (t2 - t1) / number))
+
+    # The workers are started once, and given time to fill their own pools
+    for w in workers:
+        service = IssuerService(params, issuer_params, number, workers=w)
+        service.issue_many(requests[:w])
+        time.sleep(2.0)
+        t1 = time.time()
+        service.issue_many(requests)
+        t2 = time.time()
+        service.close()
+        print("%d workers          : %7.1f us" % (w, 1e6 * (t2 - t1) / number))
+
 #####################################################
 # TASK 3 -- The user re-blinds the MAC and proves
 #           its possession without revealing the secret
@@ -212,9 +515,11 @@ def credential_Decrypt(params, priv, u, Enc_u_prime):
 ## IMPORTANT NOTE: Study the section "Credential presentation"
 #  p.9 of https://eprint.iacr.org/2013/516.pdf
 
-def credential_show(params, issuer_pub_params, u, u_prime, v):
+def credential_show(params, issuer_pub_params, u, u_prime, v, commitment_form=False):
     """ The user blinds the credential (u, u_prime) and then
-        proves its correct possession."""
+        proves its correct possession. If commitment_form is True the
+        proof holds the commitments instead of the challenge, so that
+        it may be verified in a batch."""
 
     G, g, h, o = params
     
@@ -226,12 +531,15 @@ def credential_show(params, issuer_pub_params, u, u_prime, v):
     #    using (alpha * u, alpha * u_prime) for a
     #    random alpha.
     
-    # TODO 1
+    alpha = o.random()
+    u, u_prime = alpha * u, alpha * u_prime
 
     # 2) Implement the "Show" protocol (p.9) for a single attribute v.
     #    Cv is a commitment to v and Cup is C_{u'} in the paper. 
 
-    # TODO 2
+    r, z1 = o.random(), o.random()
+    Cv = multi_mul([v, z1], [u, h])
+    Cup = u_prime + r * g
 
     tag = (u, Cv, Cup)
 
@@ -241,7 +549,17 @@ def credential_show(params, issuer_pub_params, u, u_prime, v):
     #           Cv = v *u + z1 * h and
     #           V  = r * (-g) + z1 * X1 }
 
-    ## TODO proof
+    wr, wz1, wv = o.random(), o.random(), o.random()
+    Wv = multi_mul([wv, wz1], [u, h])
+    WV = multi_mul([o - wr, wz1], [g, X1])
+
+    c = to_challenge([u, Cv, Cup, Wv, WV], [g, h, X1, Cx0])
+    rr = (wr - c * r) % o
+    rz1 = (wz1 - c * z1) % o
+    rv = (wv - c * v) % o
+
+    if commitment_form:
+        return tag, (Wv, WV, rr, rz1, rv)
 
     proof = (c, rr, rz1, rv)
     return tag, proof
@@ -256,14 +574,109 @@ def credential_show_verify(params, issuer_params, tag, proof):
     x0, x1 = sk
     X1 = iparams
 
+    if len(proof) == 5:
+        return credential_show_verify_batch(params, issuer_params, [(tag, proof)]) == [True]
+
     # Verify proof of correct credential showing
     (c, rr, rz1, rv) = proof
     (u, Cv, Cup) = tag
 
-    ## TODO
+    if u.is_infinite() or not all(G.check_point(x) for x in tag):
+        return False
 
+    # V = x0 * u + x1 * Cv - Cup, folded into the check of its proof
+    Wv = multi_mul([c, rv, rz1], [Cv, u, h])
+    WV = multi_mul([(c * x0) % o, (c * x1) % o, o - c, o - rr, rz1], [u, Cv, Cup, g, X1])
+
+    c_prime = to_challenge([u, Cv, Cup, Wv, WV], [g, h, X1, Cx0])
     return c == c_prime
 
+## _bisect is our old friend from Lab04 (see verifyKey_batch there)
+
+def _bisect(batch, check, results):
+    """ Sets results[eq[0]] for the equations eq of the batch that pass, 
+        by checking the whole batch and splitting it in halves on failure. """
+    if not batch:
+        return
+    if check(batch):
+        for eq in batch:
+            results[eq[0]] = True
+    elif len(batch) > 1:
+        _bisect(batch[:len(batch) // 2], check, results)
+        _bisect(batch[len(batch) // 2:], check, results)
+
+def credential_show_verify_batch(params, issuer_params, shows):
+    """ Verifies a list of (tag, proof) shows against the same issuer, and 
+        returns a list of booleans indicating which of them are valid.
+
+        The two equations of each proof in commitment form, 
+            Wv = c * Cv + rv * u + rz1 * h and
+            WV = c * (x0 * u + x1 * Cv - Cup) - rr * g + rz1 * X1,
+        are weighted by random 128 bit factors and summed into a single
+        multi_mul, where the terms over g, h and X1 are merged. If the sum
+        does not vanish the batch is bisected to find the invalid shows.
+        Proofs in (c, r) form are verified one by one.
+    """
+    G, g, h, o = params
+    (Cx0, iparams), (sk, x0_bar) = issuer_params
+    x0, x1 = sk
+    X1 = iparams
+    results = [False] * len(shows)
+
+    equations = []
+    for i, (tag, proof) in enumerate(shows):
+        if len(proof) != 5:
+            results[i] = credential_show_verify(params, issuer_params, tag, proof)
+            continue
+        (u, Cv, Cup), (Wv, WV, rr, rz1, rv) = tag, proof
+        if not u.is_infinite() and all(G.check_point(x) for x in [u, Cv, Cup, Wv, WV]):
+            c = to_challenge([u, Cv, Cup, Wv, WV], [g, h, X1, Cx0])
+            equations += [(i, u, Cv, Cup, Wv, WV, c, rr, rz1, rv)]
+
+    def check(batch):
+        sg, sh, sX1 = Bn(0), Bn(0), Bn(0)
+        scalars, points = [], []
+        for _, u, Cv, Cup, Wv, WV, c, rr, rz1, rv in batch:
+            rho1, rho2 = Bn.from_binary(urandom(16)), Bn.from_binary(urandom(16))
+            sg += rho2 * rr
+            sh += rho1 * rz1
+            sX1 += rho2 * rz1
+            scalars += [(rho1 * c + rho2 * c * x1) % o, 
+                        (rho1 * rv + rho2 * c * x0) % o, 
+                        (-rho2 * c) % o, o - rho1, o - rho2]
+            points += [Cv, u, Cup, Wv, WV]
+        scalars += [(-sg) % o, sh % o, sX1 % o]
+        points += [g, h, X1]
+        return multi_mul(scalars, points).is_infinite()
+
+    _bisect(equations, check, results)
+    return results
+
+def time_credential_show_verify(sizes=(10, 100, 1000)):
+    """ Prints the throughput of credential_show_verify against
+        credential_show_verify_batch. """
+    import time
+    params = credential_setup()
+    priv, pub = credential_KeyGenUser(params)
+    v, ciphertext, proof = credential_EncryptUserSecret(params, pub, priv)
+    issuer_params = credential_KeyGenIssuer(params)
+    u, E_u_prime, proof = credential_Issuing(params, pub, ciphertext, issuer_params)
+    (u, uprime) = credential_Decrypt(params, priv, u, E_u_prime)
+    issuer_pub_params = issuer_params[0]
+
+    for n in sizes:
+        shows = [credential_show(params, issuer_pub_params, u, uprime, v) for _ in range(n)]
+        batch_shows = [credential_show(params, issuer_pub_params, u, uprime, v, True) for _ in range(n)]
+
+        t1 = time.time()
+        for tag, proof in shows:
+            credential_show_verify(params, issuer_params, tag, proof)
+        t2 = time.time()
+        credential_show_verify_batch(params, issuer_params, batch_shows)
+        t3 = time.time()
+        print("%5d shows: %7.1f shows/s one by one, %7.1f shows/s in a batch" % 
+              (n, n / (t2 - t1), n / (t3 - t2)))
+
 #####################################################
 # TASK 4 -- Modify the standard Show / ShowVerify process
 #           to link the credential show to a long term 
@@ -281,16 +694,37 @@ def credential_show_pseudonym(params, issuer_pub_params, u, u_prime, v, service_
     X1 = iparams
 
     ## A stable pseudonym associated with the service 
-    N = G.hash_to_point(service_name)
+    N = hash_to_point(G, service_name)
     pseudonym = v * N
 
-    ## TODO (use code from above and modify as necessary!)
+    ## The show protocol, with the extra statement pseudonym = v * N
+
+    alpha = o.random()
+    u, u_prime = alpha * u, alpha * u_prime
+
+    r, z1 = o.random(), o.random()
+    Cv = multi_mul([v, z1], [u, h])
+    Cup = u_prime + r * g
+    tag = (u, Cv, Cup)
+
+    wr, wz1, wv = o.random(), o.random(), o.random()
+    Wv = multi_mul([wv, wz1], [u, h])
+    WV = multi_mul([o - wr, wz1], [g, X1])
+    WN = wv * N
 
+    c = to_challenge([N, pseudonym, u, Cv, Cup, Wv, WV, WN], [g, h, X1, Cx0])
+    rr = (wr - c * r) % o
+    rz1 = (wz1 - c * z1) % o
+    rv = (wv - c * v) % o
+
+    proof = (c, rr, rz1, rv)
     return pseudonym, tag, proof
 
-def credential_show_verify_pseudonym(params, issuer_params, pseudonym, tag, proof, service_name):
+def credential_show_verify_pseudonym(params, issuer_params, pseudonym, tag, proof, service_name, store=None):
     """ Verify a pseudonym H(service_name)^v is generated by the holder of the 
-        a valid credential with attribute v """
+        a valid credential with attribute v. If a PseudonymStore is given,
+        a valid show is recorded in it, and rejected if its pseudonym was
+        already recorded. """
 
     G, g, h, o = params
 
@@ -300,13 +734,500 @@ def credential_show_verify_pseudonym(params, issuer_params, pseudonym, tag, proo
     X1 = iparams
 
     ## The EC point corresponding to the service
-    N = G.hash_to_point(service_name)
+    N = hash_to_point(G, service_name)
 
     ## Verify the correct Show protocol and the correctness of the pseudonym
 
-    # TODO (use code from above and modify as necessary!)
+    (c, rr, rz1, rv) = proof
+    (u, Cv, Cup) = tag
 
-    return c == c_prime
+    if u.is_infinite() or not all(G.check_point(x) for x in [pseudonym, u, Cv, Cup]):
+        return False
+
+    Wv = multi_mul([c, rv, rz1], [Cv, u, h])
+    WV = multi_mul([(c * x0) % o, (c * x1) % o, o - c, o - rr, rz1], [u, Cv, Cup, g, X1])
+    WN = multi_mul([c, rv], [pseudonym, N])
+
+    c_prime = to_challenge([N, pseudonym, u, Cv, Cup, Wv, WV, WN], [g, h, X1, Cx0])
+    if c != c_prime:
+        return False
+
+    return store is None or store.add(pseudonym)
+
+#####################################################
+# EXTENSION -- A store of the pseudonyms already shown.
+#
+# The store is a file holding the magic b"PSEU", the 
+# capacity (a power of 2) and the number of pseudonyms,
+# followed by an open addressing hash table of capacity
+# slots of 8 bytes. A pseudonym is stored as the first 
+# 8 bytes of the SHA-256 of its encoding (0 marks an empty 
+# slot), in the first empty slot after the one given by
+# its key. Slots are only ever filled, so the file may be
+# mapped and updated in place; when the table would be more
+# than 3/4 full, it is rehashed into a file of twice the 
+# capacity, which then replaces the store.
+
+def _pseudonym_key(pseudonym):
+    key = sha256(pseudonym.export()).digest()[:8]
+    return key if key != b"\x00" * 8 else b"\x00" * 7 + b"\x01"
+
+def _create_store(path, capacity, count=0):
+    with open(path, "wb") as f:
+        f.write(b"PSEU" + pack("!II", capacity, count))
+        f.truncate(12 + 8 * capacity)
+
+class PseudonymStore(object):
+    """ A persistent set of pseudonyms, mapped from path (and created if
+        needed). Its capacity doubles whenever it would be more than 3/4
+        full. 
+
+        If bloom_bits is given, a Bloom filter of that many bits (with 4 
+        hash functions) is kept in memory in front of the table, so that 
+        most new pseudonyms are recognized without touching the mapping.
+        A store should be used by one process at a time.
+    """
+
+    def __init__(self, path, capacity=2**16, bloom_bits=None):
+        if not os.path.exists(path):
+            assert capacity > 0 and capacity & (capacity - 1) == 0
+            _create_store(path, capacity)
+
+        self.path = path
+        self._open()
+
+        self.bloom = None
+        if bloom_bits is not None:
+            self.bloom_bits = bloom_bits
+            self.bloom = bytearray(-(-bloom_bits // 8))
+            for i in range(self.capacity):
+                slot = self.map[12 + 8 * i:20 + 8 * i]
+                if slot != b"\x00" * 8:
+                    self._bloom_add(slot)
+
+    def __len__(self):
+        return self.count
+
+    def _open(self):
+        self.file = open(self.path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        if self.map[:4] != b"PSEU":
+            raise Exception("Not a pseudonym store.")
+        self.capacity, self.count = unpack_from("!II", self.map, 4)
+        assert len(self.map) == 12 + 8 * self.capacity
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def _grow(self):
+        """ Rehashes the table into a new file of twice the capacity, and 
+            replaces the store with it. """
+        tmp = self.path + ".tmp"
+        _create_store(tmp, 2 * self.capacity, self.count)
+        mask = 2 * self.capacity - 1
+        with open(tmp, "r+b") as f:
+            new = mmap.mmap(f.fileno(), 0)
+            for i in range(self.capacity):
+                slot = self.map[12 + 8 * i:20 + 8 * i]
+                if slot == b"\x00" * 8:
+                    continue
+                j = unpack_from("!Q", slot)[0] & mask
+                while new[12 + 8 * j:20 + 8 * j] != b"\x00" * 8:
+                    j = (j + 1) & mask
+                new[12 + 8 * j:20 + 8 * j] = slot
+            new.flush()
+            new.close()
+        self.close()
+        os.rename(tmp, self.path)
+        self._open()
+
+    def _bloom_positions(self, key):
+        # Keys are already hashes, so their halves give the 4 positions by double hashing
+        h1, h2 = unpack_from("!II", key)
+        return [(h1 + i * h2) % self.bloom_bits for i in range(4)]
+
+    def _bloom_add(self, key):
+        for p in self._bloom_positions(key):
+            self.bloom[p // 8] |= 1 << (p % 8)
+
+    def _bloom_has(self, key):
+        return all(self.bloom[p // 8] & (1 << (p % 8)) for p in self._bloom_positions(key))
+
+    def _find(self, key):
+        """ Returns the position of the slot holding key, or of the empty
+            slot where it would be inserted. """
+        i = unpack_from("!Q", key)[0] & (self.capacity - 1)
+        while True:
+            pos = 12 + 8 * i
+            slot = self.map[pos:pos + 8]
+            if slot == key or slot == b"\x00" * 8:
+                return pos
+            i = (i + 1) & (self.capacity - 1)
+
+    def _find_empty(self, key):
+        """ Returns the position of the empty slot where a key known to be
+            absent would be inserted. """
+        i = unpack_from("!Q", key)[0] & (self.capacity - 1)
+        while self.map[12 + 8 * i:20 + 8 * i] != b"\x00" * 8:
+            i = (i + 1) & (self.capacity - 1)
+        return 12 + 8 * i
+
+    def seen(self, pseudonym):
+        """ Returns True if the pseudonym is in the store. """
+        key = _pseudonym_key(pseudonym)
+        if self.bloom is not None and not self._bloom_has(key):
+            return False
+        pos = self._find(key)
+        return self.map[pos:pos + 8] == key
+
+    def add(self, pseudonym):
+        """ Adds the pseudonym to the store. Returns False if it was there 
+            already, and True otherwise. """
+        key = _pseudonym_key(pseudonym)
+
+        # A key missing from the Bloom filter cannot be in the table
+        pos = None
+        if self.bloom is None or self._bloom_has(key):
+            pos = self._find(key)
+            if self.map[pos:pos + 8] == key:
+                return False
+
+        if 4 * (self.count + 1) > 3 * self.capacity:
+            self._grow()
+            pos = None
+        if pos is None:
+            pos = self._find_empty(key)
+        self.map[pos:pos + 8] = key
+        self.count += 1
+        self.map[8:12] = pack("!I", self.count)
+        if self.bloom is not None:
+            self._bloom_add(key)
+        return True
+
+def time_pseudonym_store(number=10000, path="pseudonyms.bin"):
+    """ Prints the cost of adding new pseudonyms and of looking up new and 
+        known pseudonyms, with and without a Bloom filter. """
+    import time
+    G = EcGroup()
+    g = G.generator()
+    pseudonyms = [G.order().random() * g for _ in range(2 * number)]
+    new, known = pseudonyms[:number], pseudonyms[number:]
+
+    capacity = 1
+    while capacity < 2 * number:
+        capacity *= 2
+
+    for bloom_bits in [None, 16 * number]:
+        if os.path.exists(path):
+            os.remove(path)
+        store = PseudonymStore(path, capacity, bloom_bits)
+        t1 = time.time()
+        for p in known:
+            store.add(p)
+        t2 = time.time()
+        for p in new:
+            store.seen(p)
+        t3 = time.time()
+        for p in known:
+            store.seen(p)
+        t4 = time.time()
+        store.close()
+        print("bloom_bits=%-7s: add %5.1f us, new %5.1f us, known %5.1f us" % 
+              (bloom_bits, 1e6 * (t2 - t1) / number, 1e6 * (t3 - t2) / number, 1e6 * (t4 - t3) / number))
+    os.remove(path)
+
+#####################################################
+# EXTENSION -- Credentials over n attributes (MAC_GGM,
+#              Section 4 of the paper).
+#
+# The issuer holds x0, x1 .. xn and publishes Cx0 and 
+# Xi = xi * h. A credential on attributes m1 .. mn is
+# (u, u') = (u, (x0 + Sum xi * mi) * u), two points for any
+# n. Attributes may be issued in the clear, or blindly: 
+# the user then encrypts those to hide from the issuer, 
+# who returns u' encrypted, as for the single attribute v.
+# At a show, the user reveals the attributes of its
+# choice, and only hides the others behind a commitment
+# each. Attributes are indexed from 0 below.
+
+def credential_KeyGenIssuer_n(params, n):
+    """ Generates keys and parameters for the credential issuer for n attributes """
+    _, g, h, o = params
+
+    xs = [o.random() for _ in range(n + 1)]
+    iparams = [x * h for x in xs[1:]]
+
+    x0_bar = o.random()
+    Cx0 = multi_mul([xs[0], x0_bar], [g, h])
+
+    return (Cx0, iparams), (xs, x0_bar)
+
+def credential_Issuing_n(params, issuer_params, attributes):
+    """ Issues a MAC on a list of attributes known to the issuer (see 
+        credential_BlindIssuing_n to hide some), with a proof that
+        it was computed with the keys committed to in Cx0 and the Xi:
+
+        NIZK{(x0, x0_bar, x1 .. xn): 
+              u_prime = x0 * u + Sum xi * (mi * u) and
+              Cx0 = x0 * g + x0_bar * h and
+              Xi = xi * h for each i}
+    """
+    G, g, h, o = params
+    (Cx0, Xs), (xs, x0_bar) = issuer_params
+    assert len(attributes) == len(Xs)
+
+    u = o.random() * g
+    exponent = (xs[0] + sum((x * m for x, m in zip(xs[1:], attributes)), Bn(0))) % o
+    u_prime = exponent * u
+
+    secrets = [xs[0], x0_bar] + xs[1:]
+    ws = [o.random() for _ in secrets]
+    Ws = [(ws[0] + sum((w * m for w, m in zip(ws[2:], attributes)), Bn(0))) % o * u,
+          multi_mul([ws[0], ws[1]], [g, h])]
+    Ws += [w * h for w in ws[2:]]
+
+    c = to_challenge([u, u_prime] + Ws, [g, h, Cx0] + Xs)
+    rs = [(w - c * x) % o for w, x in zip(ws, secrets)]
+
+    return (u, u_prime), (c, rs)
+
+def credential_Verify_Issuing_n(params, issuer_pub_params, attributes, mac, proof):
+    """ The user verifies the proof of correctness of its MAC. """
+    G, g, h, o = params
+    (Cx0, Xs) = issuer_pub_params
+    (u, u_prime), (c, rs) = mac, proof
+
+    if len(rs) != len(Xs) + 2 or len(attributes) != len(Xs):
+        return False
+    if u.is_infinite() or not (G.check_point(u) and G.check_point(u_prime)):
+        return False
+
+    Ws = [multi_mul([c, (rs[0] + sum((r * m for r, m in zip(rs[2:], attributes)), Bn(0))) % o], 
+                    [u_prime, u]),
+          multi_mul([c, rs[0], rs[1]], [Cx0, g, h])]
+    Ws += [multi_mul([c, r], [X, h]) for r, X in zip(rs[2:], Xs)]
+
+    return to_challenge([u, u_prime] + Ws, [g, h, Cx0] + Xs) == c
+
+def credential_EncryptUserAttributes_n(params, pub, priv, attributes, hidden):
+    """ Encrypts the attributes whose indexes are in hidden under the 
+        public key of the user, as credential_EncryptUserSecret does for v.
+        Returns a dict from the indexes to the ciphertexts, and a proof:
+
+        NIZK{(priv, ki, mi for i in hidden): pub = priv * g and
+              ai = ki * g and bi = ki * pub + mi * g for i in hidden}
+    """
+    G, g, h, o = params
+    hidden = sorted(hidden)
+
+    ks = [o.random() for _ in hidden]
+    ciphertexts = dict((i, (k * g, multi_mul([k, attributes[i]], [pub, g]))) 
+                       for i, k in zip(hidden, ks))
+
+    wpriv = o.random()
+    wks = [o.random() for _ in hidden]
+    wms = [o.random() for _ in hidden]
+    Ws = [wpriv * g] + [wk * g for wk in wks]
+    Ws += [multi_mul([wk, wm], [pub, g]) for wk, wm in zip(wks, wms)]
+
+    c = to_challenge([pub] + [x for i in hidden for x in ciphertexts[i]] + Ws, [g, h])
+    rpriv = (wpriv - c * priv) % o
+    rks = [(w - c * k) % o for w, k in zip(wks, ks)]
+    rms = [(w - c * attributes[i]) % o for w, i in zip(wms, hidden)]
+
+    return ciphertexts, (c, rpriv, rks, rms)
+
+def credential_VerifyUserAttributes_n(params, pub, ciphertexts, proof):
+    """ The issuer verifies the encryption of the hidden attributes. """
+    G, g, h, o = params
+    (c, rpriv, rks, rms) = proof
+    hidden = sorted(ciphertexts)
+
+    if not len(rks) == len(rms) == len(hidden):
+        return False
+    if not all(G.check_point(x) for i in hidden for x in ciphertexts[i]):
+        return False
+
+    Ws = [multi_mul([c, rpriv], [pub, g])]
+    Ws += [multi_mul([c, rk], [ciphertexts[i][0], g]) for i, rk in zip(hidden, rks)]
+    Ws += [multi_mul([c, rk, rm], [ciphertexts[i][1], pub, g]) 
+           for i, rk, rm in zip(hidden, rks, rms)]
+
+    return to_challenge([pub] + [x for i in hidden for x in ciphertexts[i]] + Ws, [g, h]) == c
+
+def credential_BlindIssuing_n(params, issuer_params, attributes, pub, ciphertexts):
+    """ Issues a MAC on a list of attributes, of which those at the indexes
+        of ciphertexts are only known encrypted under pub (and are ignored in
+        attributes), as credential_Issuing does for a single attribute. 
+        Returns u, u' encrypted under pub, and a proof that:
+
+        NIZK{(beta, r', x0, x0_bar, x1 .. xn, xib for the hidden):
+              u = beta * g and Cx0 = x0 * g + x0_bar * h and
+              Xi = xi * h for each i and
+              XiB = beta * Xi and XiB = xib * h for the hidden and
+              new_a = r' * g + Sum xib * ai over the hidden and
+              new_b = r' * pub + Sum xib * bi over the hidden 
+                      + (x0 + Sum xi * mi over the others) * u }
+    """
+    G, g, h, o = params
+    (Cx0, Xs), (xs, x0_bar) = issuer_params
+    n = len(Xs)
+    assert len(attributes) == n and all(i in range(n) for i in ciphertexts)
+    hidden = sorted(ciphertexts)
+    others = [i for i in range(n) if i not in ciphertexts]
+    As = [ciphertexts[i][0] for i in hidden]
+    Bs = [ciphertexts[i][1] for i in hidden]
+
+    # u = beta * g, so that xib * (mi * g) = (xi * mi) * u for the hidden
+    beta, r_prime = o.random(), o.random()
+    u = beta * g
+    xibs = [(beta * xs[i + 1]) % o for i in hidden]
+    XiBs = [beta * Xs[i] for i in hidden]
+
+    ux = (xs[0] + sum((xs[i + 1] * attributes[i] for i in others), Bn(0))) % o
+    new_a = multi_mul([r_prime] + xibs, [g] + As)
+    new_b = multi_mul([r_prime, ux] + xibs, [pub, u] + Bs)
+
+    secrets = [beta, r_prime, xs[0], x0_bar] + xs[1:] + xibs
+    ws = [o.random() for _ in secrets]
+    wxs, wxibs = ws[4:4 + n], ws[4 + n:]
+    wux = (ws[2] + sum((wxs[i] * attributes[i] for i in others), Bn(0))) % o
+    Ws = [ws[0] * g, multi_mul([ws[2], ws[3]], [g, h])]
+    Ws += [w * h for w in wxs]
+    Ws += [ws[0] * Xs[i] for i in hidden]
+    Ws += [w * h for w in wxibs]
+    Ws += [multi_mul([ws[1]] + wxibs, [g] + As),
+           multi_mul([ws[1], wux] + wxibs, [pub, u] + Bs)]
+
+    c = to_challenge([pub, u, new_a, new_b] + As + Bs + XiBs + Ws, [g, h, Cx0] + Xs)
+    rs = [(w - c * x) % o for w, x in zip(ws, secrets)]
+
+    return u, (new_a, new_b), (c, rs, XiBs)
+
+def credential_Verify_BlindIssuing_n(params, issuer_pub_params, attributes, pub, ciphertexts, 
+                                     u, E_u_prime, proof):
+    """ The user verifies the proof of correctness of its encrypted MAC; 
+        the attributes at the indexes of ciphertexts are ignored. """
+    G, g, h, o = params
+    (Cx0, Xs) = issuer_pub_params
+    (new_a, new_b), (c, rs, XiBs) = E_u_prime, proof
+    n = len(Xs)
+
+    if len(attributes) != n or not all(i in range(n) for i in ciphertexts):
+        return False
+    hidden = sorted(ciphertexts)
+    others = [i for i in range(n) if i not in ciphertexts]
+    if len(rs) != 4 + n + len(hidden) or len(XiBs) != len(hidden):
+        return False
+    if u.is_infinite() or not all(G.check_point(x) for x in [u, new_a, new_b] + XiBs):
+        return False
+    As = [ciphertexts[i][0] for i in hidden]
+    Bs = [ciphertexts[i][1] for i in hidden]
+
+    rxs, rxibs = rs[4:4 + n], rs[4 + n:]
+    rux = (rs[2] + sum((rxs[i] * attributes[i] for i in others), Bn(0))) % o
+    Ws = [multi_mul([c, rs[0]], [u, g]), multi_mul([c, rs[2], rs[3]], [Cx0, g, h])]
+    Ws += [multi_mul([c, r], [X, h]) for r, X in zip(rxs, Xs)]
+    Ws += [multi_mul([c, rs[0]], [XiB, Xs[i]]) for XiB, i in zip(XiBs, hidden)]
+    Ws += [multi_mul([c, r], [XiB, h]) for r, XiB in zip(rxibs, XiBs)]
+    Ws += [multi_mul([c, rs[1]] + rxibs, [new_a, g] + As),
+           multi_mul([c, rs[1], rux] + rxibs, [new_b, pub, u] + Bs)]
+
+    return to_challenge([pub, u, new_a, new_b] + As + Bs + XiBs + Ws, [g, h, Cx0] + Xs) == c
+
+def credential_show_n(params, issuer_pub_params, mac, attributes, hidden):
+    """ Blinds the MAC and proves its possession, hiding the attributes
+        whose indexes are in hidden and revealing the others. The tag
+        holds u, the commitments to the hidden attributes and C_{u'}:
+
+        NIZK{(r, zi, mi for i in hidden):
+              Cmi = mi * u + zi * h for i in hidden and
+              V = r * (-g) + Sum zi * Xi }
+    """
+    G, g, h, o = params
+    (Cx0, Xs) = issuer_pub_params
+    hidden = sorted(hidden)
+
+    alpha = o.random()
+    u, u_prime = alpha * mac[0], alpha * mac[1]
+
+    r = o.random()
+    zs = [o.random() for _ in hidden]
+    Cms = [multi_mul([attributes[i], z], [u, h]) for i, z in zip(hidden, zs)]
+    Cup = u_prime + r * g
+    tag = (u, Cms, Cup)
+
+    wr = o.random()
+    wzs = [o.random() for _ in hidden]
+    wms = [o.random() for _ in hidden]
+    Wms = [multi_mul([wm, wz], [u, h]) for wm, wz in zip(wms, wzs)]
+    WV = multi_mul([o - wr] + wzs, [g] + [Xs[i] for i in hidden])
+
+    c = to_challenge([u, Cup] + Cms + Wms + [WV], [g, h, Cx0] + Xs)
+    rr = (wr - c * r) % o
+    rzs = [(w - c * z) % o for w, z in zip(wzs, zs)]
+    rms = [(w - c * attributes[i]) % o for w, i in zip(wms, hidden)]
+
+    return tag, (c, rr, rzs, rms)
+
+def credential_show_verify_n(params, issuer_params, disclosed, tag, proof):
+    """ Verifies a show of a credential, given the dict of the disclosed
+        attributes; every other attribute must be hidden in the tag. """
+    G, g, h, o = params
+    (Cx0, Xs), (xs, x0_bar) = issuer_params
+    (u, Cms, Cup), (c, rr, rzs, rms) = tag, proof
+
+    if not all(i in range(len(Xs)) for i in disclosed):
+        return False
+    hidden = [i for i in range(len(Xs)) if i not in disclosed]
+    if not len(Cms) == len(rzs) == len(rms) == len(hidden):
+        return False
+    if u.is_infinite() or not all(G.check_point(x) for x in [u, Cup] + Cms):
+        return False
+
+    # V = (x0 + Sum xi * mi over the disclosed) * u + Sum xi * Cmi over the hidden - Cup
+    ux = (xs[0] + sum((xs[i + 1] * m for i, m in disclosed.items()), Bn(0))) % o
+    Wms = [multi_mul([c, rm, rz], [Cm, u, h]) for Cm, rm, rz in zip(Cms, rms, rzs)]
+    WV = multi_mul([(c * ux) % o, o - c, o - rr] + [(c * xs[i + 1]) % o for i in hidden] + rzs, 
+                   [u, Cup, g] + Cms + [Xs[i] for i in hidden])
+
+    return to_challenge([u, Cup] + Cms + Wms + [WV], [g, h, Cx0] + Xs) == c
+
+def time_credential_n(attribute_counts=(1, 5, 10, 20), number=20):
+    """ Prints the cost of issuing, showing (with all attributes hidden, 
+        and with all but one disclosed) and verifying a credential, against 
+        the number of attributes. """
+    import time
+    params = credential_setup()
+    G, g, h, o = params
+
+    for n in attribute_counts:
+        issuer_params = credential_KeyGenIssuer_n(params, n)
+        attributes = [o.random() for _ in range(n)]
+
+        t1 = time.time()
+        for _ in range(number):
+            mac, proof = credential_Issuing_n(params, issuer_params, attributes)
+        t2 = time.time()
+
+        timings = []
+        for hidden in [range(n), [0]]:
+            disclosed = dict((i, attributes[i]) for i in range(n) if i not in hidden)
+            t3 = time.time()
+            shows = [credential_show_n(params, issuer_params[0], mac, attributes, hidden) 
+                     for _ in range(number)]
+            t4 = time.time()
+            for tag, proof in shows:
+                credential_show_verify_n(params, issuer_params, disclosed, tag, proof)
+            t5 = time.time()
+            timings += [(t4 - t3, t5 - t4, len(tag[1]) + 2)]
+
+        print("%2d attributes: issue %5.1f ms | all hidden: show %5.1f ms, verify %5.1f ms, "
+              "tag of %2d points | one hidden: show %5.1f ms, verify %5.1f ms, tag of %d points" % 
+              ((n, 1000 * (t2 - t1) / number) + 
+               tuple(x for (ts, tv, size) in timings for x in (1000 * ts / number, 1000 * tv / number, size))))
 
 #####################################################
 # TASK Q1 -- Answer the following question:
@@ -67,6 +67,29 @@ def test_issue_correct_MAC_decrypt():
     (u, uprime) =  credential_Decrypt(params, priv, u, E_u_prime)
     assert uprime == (sk[0] + v * sk[1]) * u
 
+@pytest.mark.task2
+def test_issuer_service():
+    params = credential_setup()
+    issuer_params = credential_KeyGenIssuer(params)
+    (Cx0, iparams), (sk, x0_bar) = issuer_params
+
+    users = []
+    for _ in range(3):
+        priv, pub = credential_KeyGenUser(params)
+        v, ciphertext, proof = credential_EncryptUserSecret(params, pub, priv)
+        users += [(priv, pub, v, ciphertext)]
+    requests = [(pub, ciphertext) for priv, pub, v, ciphertext in users]
+
+    for workers in [None, 2]:
+        service = IssuerService(params, issuer_params, size=2, workers=workers)
+        # The second call reuses the processes of the service
+        for issued in [service.issue_many(requests), service.issue_many(requests)]:
+            for (priv, pub, v, ciphertext), (u, E_u_prime, proof) in zip(users, issued):
+                assert credential_Verify_Issuing(params, (Cx0, iparams), pub, u, ciphertext, E_u_prime, proof)
+                u, uprime = credential_Decrypt(params, priv, u, E_u_prime)
+                assert uprime == (sk[0] + v * sk[1]) * u
+        service.close()
+
 @pytest.mark.task3
 def test_Show():
     params = credential_setup()
@@ -103,6 +126,30 @@ def test_Show_Verify():
 
     assert credential_show_verify(params, issuer_params, tag, proof)
 
+@pytest.mark.task3
+def test_Show_Verify_batch():
+    params = credential_setup()
+    priv, pub = credential_KeyGenUser(params)
+    v, ciphertext, proof = credential_EncryptUserSecret(params, pub, priv)
+
+    issuer_params = credential_KeyGenIssuer(params)
+    (Cx0, iparams), (sk, x0_bar) = issuer_params
+    u, E_u_prime, proof = credential_Issuing(params, pub, ciphertext, issuer_params)
+    (u, uprime) =  credential_Decrypt(params, priv, u, E_u_prime)
+
+    issuer_pub_params = (Cx0, iparams)
+    shows = [credential_show(params, issuer_pub_params, u, uprime, v, True) for _ in range(4)]
+    shows += [credential_show(params, issuer_pub_params, u, uprime, v)]
+    assert credential_show_verify(params, issuer_params, *shows[0])
+    assert credential_show_verify_batch(params, issuer_params, shows) == [True] * 5
+
+    # A forged MAC, and a tag with a changed commitment
+    (G, g, h, o) = params
+    shows[1] = credential_show(params, issuer_pub_params, u, uprime + g, v, True)
+    (u2, Cv2, Cup2), proof2 = shows[3]
+    shows[3] = ((u2, Cv2 + h, Cup2), proof2)
+    assert credential_show_verify_batch(params, issuer_params, shows) == [True, False, True, False, True]
+
 @pytest.mark.task4
 def test_Show_Verify_Pseudonym():
     params = credential_setup()
@@ -142,4 +189,116 @@ def test_Show_Verify_Pseudonym_stability():
     pseudonym2, tag, proof = credential_show_pseudonym(params, issuer_pub_params, u, uprime, v, b"Service A")
     assert credential_show_verify_pseudonym(params, issuer_params, pseudonym2, tag, proof, b"Service A")
 
-    assert pseudonym == pseudonym2
\ No newline at end of file
+    assert pseudonym == pseudonym2
+
+@pytest.mark.task4
+def test_service_point_cache():
+    from Lab05Code import _hashed_points
+    params = credential_setup()
+    (G, g, h, o) = params
+    assert credential_setup() is params
+
+    hits = _hashed_points.hits
+    N = hash_to_point(G, b"Service B")
+    assert N == G.hash_to_point(b"Service B")
+    assert hash_to_point(G, b"Service B") is N
+    assert _hashed_points.hits == hits + 1
+
+@pytest.mark.task4
+def test_pseudonym_store(tmpdir):
+    params = credential_setup()
+    (G, g, h, o) = params
+    path = str(tmpdir.join("pseudonyms.bin"))
+
+    store = PseudonymStore(path, capacity=16)
+    points = [o.random() * g for _ in range(12)]
+    assert [store.add(p) for p in points] == [True] * 12
+    assert not store.add(points[0])
+
+    # Past 3/4 of its capacity the store grows, keeping what it holds
+    points += [o.random() * g for _ in range(28)]
+    assert [store.add(p) for p in points[12:]] == [True] * 28
+    assert store.capacity == 64 and len(store) == 40
+    assert not any(store.add(p) for p in points)
+    store.close()
+
+    store = PseudonymStore(path, bloom_bits=1024)
+    assert store.capacity == 64 and len(store) == 40
+    assert all(store.seen(p) for p in points)
+    assert not store.seen(h)
+    store.close()
+
+    priv, pub = credential_KeyGenUser(params)
+    v, ciphertext, proof = credential_EncryptUserSecret(params, pub, priv)
+    issuer_params = credential_KeyGenIssuer(params)
+    u, E_u_prime, proof = credential_Issuing(params, pub, ciphertext, issuer_params)
+    (u, uprime) =  credential_Decrypt(params, priv, u, E_u_prime)
+
+    # Verification still answers once the store is past its initial capacity
+    store = PseudonymStore(str(tmpdir.join("service.bin")), capacity=2, bloom_bits=1024)
+    for service in [b"Service A", b"Service B", b"Service C"]:
+        for expected in [True, False]:
+            pseudonym, tag, proof = credential_show_pseudonym(params, issuer_params[0], u, uprime, v, service)
+            assert credential_show_verify_pseudonym(params, issuer_params, pseudonym, tag, proof, service, store) == expected
+    assert store.capacity == 4 and len(store) == 3
+    store.close()
+
+@pytest.mark.task4
+def test_credential_n():
+    params = credential_setup()
+    (G, g, h, o) = params
+
+    issuer_params = credential_KeyGenIssuer_n(params, 5)
+    issuer_pub_params, _ = issuer_params
+    attributes = [10, 20, 30, 40, 50]
+
+    mac, proof = credential_Issuing_n(params, issuer_params, attributes)
+    assert credential_Verify_Issuing_n(params, issuer_pub_params, attributes, mac, proof)
+    assert not credential_Verify_Issuing_n(params, issuer_pub_params, [11, 20, 30, 40, 50], mac, proof)
+
+    tag, proof = credential_show_n(params, issuer_pub_params, mac, attributes, [1, 3])
+    assert len(tag[1]) == 2
+    assert credential_show_verify_n(params, issuer_params, {0: 10, 2: 30, 4: 50}, tag, proof)
+    assert not credential_show_verify_n(params, issuer_params, {0: 10, 2: 31, 4: 50}, tag, proof)
+    assert not credential_show_verify_n(params, issuer_params, {0: 10, 4: 50}, tag, proof)
+
+    tag, proof = credential_show_n(params, issuer_pub_params, mac, attributes, range(5))
+    assert credential_show_verify_n(params, issuer_params, {}, tag, proof)
+
+    # Disclosed indices must name attributes
+    assert not credential_show_verify_n(params, issuer_params, {-1: 0}, tag, proof)
+    assert not credential_show_verify_n(params, issuer_params, {5: 0}, tag, proof)
+
+    # A MAC from another issuer does not verify
+    other_params = credential_KeyGenIssuer_n(params, 5)
+    assert not credential_show_verify_n(params, other_params, {}, tag, proof)
+
+@pytest.mark.task4
+def test_credential_n_blind():
+    params = credential_setup()
+    (G, g, h, o) = params
+
+    issuer_params = credential_KeyGenIssuer_n(params, 4)
+    issuer_pub_params, _ = issuer_params
+    priv, pub = credential_KeyGenUser(params)
+    attributes = [10, o.random(), 30, o.random()]
+
+    # The issuer only sees the attributes 1 and 3 encrypted
+    ciphertexts, proof = credential_EncryptUserAttributes_n(params, pub, priv, attributes, [1, 3])
+    assert sorted(ciphertexts) == [1, 3]
+    assert credential_VerifyUserAttributes_n(params, pub, ciphertexts, proof)
+    assert not credential_VerifyUserAttributes_n(params, pub, {1: ciphertexts[1], 3: ciphertexts[1]}, proof)
+
+    seen = [10, None, 30, None]
+    u, E_u_prime, proof = credential_BlindIssuing_n(params, issuer_params, seen, pub, ciphertexts)
+    assert credential_Verify_BlindIssuing_n(params, issuer_pub_params, seen, pub, ciphertexts, u, E_u_prime, proof)
+    assert not credential_Verify_BlindIssuing_n(params, issuer_pub_params, [11, None, 30, None], pub, ciphertexts, u, E_u_prime, proof)
+    other_params = credential_KeyGenIssuer_n(params, 4)
+    assert not credential_Verify_BlindIssuing_n(params, other_params[0], seen, pub, ciphertexts, u, E_u_prime, proof)
+
+    mac = credential_Decrypt(params, priv, u, E_u_prime)
+    tag, proof = credential_show_n(params, issuer_pub_params, mac, attributes, [1, 3])
+    assert credential_show_verify_n(params, issuer_params, {0: 10, 2: 30}, tag, proof)
+    tag, proof = credential_show_n(params, issuer_pub_params, mac, attributes, [1])
+    assert credential_show_verify_n(params, issuer_params, {0: 10, 2: 30, 3: attributes[3]}, tag, proof)
+